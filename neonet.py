@@ -13,66 +13,81 @@ For info contact michael.allen1966@gmail.com
 # todo fix patient log number of transfers not being recorded (done - to be checked)
 
 import simpy
+import sys
+import heapq
 import random
 import time
 import numpy as np
 import copy
 
 # Import classes from modules
+from neonet_modules.config import Config, Clock
 from neonet_modules.patient import Patient
 from neonet_modules.data import Data
 from neonet_modules.network import Network
+from neonet_modules.flows import Flows
+from neonet_modules.progress import Progress
+from neonet_modules.memory import MemoryMonitor
+from neonet_modules.arrivals import ArrivalProfile
+from neonet_modules.streams import RandomStreams
 from neonet_modules.audit import Audit
 from neonet_modules.summarise import Summarise
+from neonet_modules.results import Results
 
-class Glob_vars:  # misc global data
-    truncate_data = False  # use True for code testing only: results will not be correct
-    warm_up = 366
-    sim_duration = 365 * 10  # sim duration after warm-up
-    sim_duration += warm_up
-    arrivals_per_day = 228
-    interarrival_time = 1 / (arrivals_per_day)  # 1 /arrivals per day
-    nurse_for_care_level = [1, 1, 0.5, 0.25, 0.125]  # Nurse requirements for surgery --> TC
-    allowed_overload_fraction = 1.5  # allowed fraction of BAPM guidelines allowed
-    day = 0
-    year = 1
-    output_folder = 'output/test2'
+
+class Model:
     network_count_columns = ['current_surgery',
                              'current_level_1',
                              'current_level_2',
                              'current_level_3',
                              'current_level_4']
 
-
-class Model:
-    def __init__(self):
-        """ Set up simulation environment"""
+    def __init__(self, config=None, data=None):
+        """ Set up simulation environment with run configuration (default Config()) and its own
+        clock. Previously loaded Data may be passed in to reuse."""
         self.env = simpy.Environment()
+        self.config = config if config is not None else Config()
+        self.clock = Clock()
+        self.data = data
+        self.arrival_profile = None
+        if self.config.arrival_profile is not None:
+            self.arrival_profile = ArrivalProfile(self.config.arrivals_per_day,
+                                                  **self.config.arrival_profile)
 
     def day_audit_process(self):
         """Trigger audits each day. Starts after warm up period."""
         # Delay of woarm up period before first audit
-        yield self.env.timeout(Glob_vars.warm_up)
+        yield self.env.timeout(self.config.warm_up)
+        if self.memory is not None:
+            self.memory.start_phase('steady_state')
 
         # Daily audits
         while True:
-            self.audit.perform_daily_audit(Glob_vars.day, Glob_vars.year, self.network,
-                                           Glob_vars.output_folder)
+            self.audit.perform_daily_audit(self.network)
             # Trigger next audit in 1 day
             yield self.env.timeout(1)
 
+    def memory_process(self):
+        """Sample memory use at intervals (if memory monitoring)"""
+        while True:
+            yield self.env.timeout(self.config.memory_interval)
+            self.memory.sample(self.env.now, self)
+
     def day_count_process(self):
         """Day count. Increment each day. Also calculate year"""
         while True:
             yield self.env.timeout(1)
-            Glob_vars.day += 1
-            Glob_vars.year = int(Glob_vars.day / 365) + 1
-            print('Day: %d' % Glob_vars.day)
+            _new_year = self.clock.next_day()
+            if _new_year and self.arrival_profile is not None:
+                _weights = self.arrival_profile.lsoa_weights(self.data, self.clock.year)
+                if _weights is not None:
+                    self.set_lsoa_weights(_weights)
+            self.progress.update(self.clock.day, self.network, self.audit)
 
     def find_hospital_bed(self, p):
         # set required care level and nurses
         _required_care_level = p.required_care_level_current
-        _required_nurse_resources = Glob_vars.nurse_for_care_level[_required_care_level]
+        _required_nurse_resources = self.config.nurse_for_care_level[_required_care_level]
 
         # set required unit type
         # default to care level (0=surg --> 4 = TC),
@@ -134,75 +149,129 @@ class Model:
 
                 # Calculate current nursing capacity in hospital being inspected (with allowed overloading)
                 _hospital_capacity = ((self.network.status['nursing_capacity'].loc[hospital] *
-                                       Glob_vars.allowed_overload_fraction) -
+                                       self.config.allowed_overload_fraction) -
                                       self.network.status['current_workload'].loc[hospital])
 
                 # Check if hospital has sufficient nursing capacity
                 if _hospital_capacity >= _required_nurse_resources:
                     ## BED FOUND ##
                     _bed_found = 1
+                    self.admit_patient(p, hospital, _required_nurse_resources)
 
-                    # Adjust hospital nursing resources used
-                    _new_value = self.network.status.loc[hospital][
-                                     'current_workload'] + _required_nurse_resources
-                    self.network.status.set_value(hospital, 'current_workload', _new_value)
-
-                    # Adjust hospital care level count
-                    network_col = Glob_vars.network_count_columns[p.required_care_level_current]
-                    _new_value = self.network.status.loc[hospital][network_col] + 1
-                    self.network.status.set_value(hospital, network_col, _new_value)
-
-                    # Adjust hospital total infant count
-                    _new_value = self.network.status.loc[hospital]['all_infants'] + 1
-                    self.network.status.set_value(hospital, 'all_infants', _new_value)
-
-                    # Set hospital on patient object
-                    p.current_hospital = hospital
-                    p.current_network = self.data.network_lookup.loc[p.current_hospital].item()
-                    p.in_home_network = 1 if p.current_network == p.home_network else 0
+                    # Return
+                    return _bed_found
 
-                    # Add patient object to network patients dictionary
-                    self.network.patients[p.id] = p  # add patient to dictionary of patients
+        return _bed_found
 
-                    # Calculate distance from home
-                    p.distance_from_home = self.data.travel_tuples[(p.lsoa, hospital)]
+    def admit_patient(self, p, hospital, _required_nurse_resources):
+        """Place patient in hospital: update hospital tracking, patient location, flows,
+        transfers and displaced patients"""
+        # Adjust hospital nursing resources used
+        _new_value = self.network.status.loc[hospital][
+                         'current_workload'] + _required_nurse_resources
+        self.network.status.set_value(hospital, 'current_workload', _new_value)
+
+        # Adjust hospital care level count
+        network_col = self.network_count_columns[p.required_care_level_current]
+        _new_value = self.network.status.loc[hospital][network_col] + 1
+        self.network.status.set_value(hospital, network_col, _new_value)
+
+        # Adjust hospital total infant count
+        _new_value = self.network.status.loc[hospital]['all_infants'] + 1
+        self.network.status.set_value(hospital, 'all_infants', _new_value)
+
+        # Set hospital on patient object
+        p.current_hospital = hospital
+        p.current_network = self.data.network_lookup.loc[p.current_hospital].item()
+        p.in_home_network = 1 if p.current_network == p.home_network else 0
+
+        # Add patient object to network patients dictionary
+        self.network.patients[p.id] = p  # add patient to dictionary of patients
+
+        # Record LSOA -> hospital flow (after warm up)
+        if self.env.now >= self.config.warm_up:
+            self.flows.record_admission(p.lsoa, hospital, p.required_care_level_current,
+                                        self.clock.year)
+
+        # Calculate distance from home
+        self.set_distance_from_home(p, hospital)
+
+        # Look to see if new hopsital is different from last
+        if p.current_hospital != p.previous_hospital:
+            # Transfer required
+            self.transfer_patient(p.previous_hospital, p.current_hospital, p)
+
+        # Check if patient is in the closest appropriate unit
+        if p.closest_appropriate_hospital == p.current_hospital:
+            p.in_closest_appropriate_hospital = True
+        else:
+            p.in_closest_appropriate_hospital = False
+            # Add to list of displaced patients
+            self.network.displaced_patients_ids.append(p.id)
+
+        # Record selected hospital as previous hospital (used to look for change in location on next spell)
+        p.previous_hospital = p.current_hospital
+
+    def run(self):
+        """Run model. Returns Results (summary tables, and audit tables if kept in memory)."""
+        self.set_up_run()
 
-                    # Look to see if new hopsital is different from last
-                    if p.current_hospital != p.previous_hospital:
-                        # Transfer required
-                        self.transfer_patient(p.previous_hospital, p.current_hospital, p)
+        # Run model
+        self.env.run(until=self.config.sim_duration)
 
-                    # Check if patient is in the closest appropriate unit
-                    if p.closest_appropriate_hospital == p.current_hospital:
-                        p.in_closest_appropriate_hospital = True
-                    else:
-                        p.in_closest_appropriate_hospital = False
-                        # Add to list of displaced patients
-                        self.network.displaced_patients_ids.append(p.id)
+        return self.end_run()
 
-                    # Record selected hospital as previous hospital (used to look for change in location on next spell)
-                    p.previous_hospital = p.current_hospital
+    def set_distance_from_home(self, p, hospital):
+        """Set patient travel time from home to hospital, and count it (after warm up)"""
+        p.distance_from_home = self.data.travel_times[self.data.lsoa_index[p.lsoa],
+                                                      self.data.hospital_index[hospital]]
+        if self.env.now >= self.config.warm_up:
+            self.audit.record_travel_time(self.clock.year, p.required_care_level_current,
+                                          p.home_network, p.distance_from_home)
 
-                    # Return
-                    return _bed_found
+    def model_run(self):
+        return self.run()
 
-        return _bed_found
+    def set_up_run(self):
+        # Check output format can be written before run
+        Summarise.check_output_format(self.config.output_format)
 
-    def model_run(self):
-        # Load data
+        # Load data (unless already loaded)
         self.start_time = time.time()
-        self.data = Data(truncate=Glob_vars.truncate_data)
+        self.memory = None
+        if self.config.memory_interval:
+            self.memory = MemoryMonitor()
+            self.memory.start_phase('load')
+        if self.data is None:
+            self.data = Data.load(self.config.truncate_data, self.config.data_folder,
+                                  cache_folder=self.config.data_cache_folder)
+
+        # LSOA demand weights (changed by region growth during run; Data is not changed)
+        self.set_lsoa_weights(self.data.lsoa_weights)
 
         # Set up network status dataframe
         self.network = Network(self.data.hospitals, list(self.data.hospital_info_df[
                                                              'nurse_capacity']))
 
-        # Set up audit
-        self.audit = Audit()
+        # Set up audit and origin-destination flow counts
+        self.audit = Audit(self.config, self.clock)
+        self.flows = Flows(list(self.data.lsoa_demand.index), self.data.hospitals)
+
+        # Set up audit output (files and/or memory)
+        self.audit.set_up_output(
+            self.config.output_folder if self.config.write_output else None,
+            keep_logs=self.config.keep_logs)
 
-        # Set up output files
+        # Set up common random number streams for arrivals (if used)
+        self.streams = None
+        if self.config.crn_seed is not None:
+            self.streams = RandomStreams(self.config.crn_seed)
 
-        self.audit.set_up_output(Glob_vars.output_folder)
+        # Set up progress reporting
+        self.progress = Progress(self.config.sim_duration,
+                                 interval=self.config.progress_interval,
+                                 json_file=self.config.progress_file,
+                                 socket_address=self.config.progress_address)
 
         # Initialise model processes
         # Process fo rgenerating new patients
@@ -213,39 +282,84 @@ class Model:
         self.env.process(self.relocate_displaced_process())
         # Process to run audits
         self.env.process(self.day_audit_process())
-
-        # Run model
-        self.env.run(until=Glob_vars.sim_duration)
-
+        # Process to sample memory use
+        if self.memory is not None:
+            self.memory.start_phase('warm_up')
+            self.env.process(self.memory_process())
+
+    def set_lsoa_weights(self, weights):
+        """Set LSOA demand weights used to select LSOA of new patients"""
+        self.lsoa_weights = weights
+        self.lsoa_cumulative_weights = np.cumsum(weights.values)
+
+    def set_capacities(self, nurse_capacity):
+        """Set nursing capacity of hospitals (Series indexed by hospital)"""
+        self.network.status['nursing_capacity'] = nurse_capacity.loc[
+            self.network.status.index].values
+
+    def run_from_warm_up(self, output_folder=None):
+        """Continue a model which has been run to the end of warm up, writing audits to
+        output_folder, or keeping them in memory if None (used to evaluate capacity options
+        from a shared warm up state)"""
+        if output_folder is not None:
+            self.config = self.config._replace(output_folder=output_folder)
+        self.audit.set_up_output(output_folder, keep_logs=self.config.keep_logs)
+        self.env.run(until=self.config.sim_duration)
+
+    def end_run(self):
         # Model end
+        self.progress.close(self.clock.day, self.network, self.audit)
         self.end_time = time.time()
-        Summarise(self.audit, Glob_vars.output_folder)
+        # Complete audit writes (background writer) before summarising
+        self.audit.close()
+        if self.memory is not None:
+            self.memory.start_phase('summarise')
+        tables = Summarise(self.audit, self.flows).summarise()
+        memory = self.memory.report() if self.memory is not None else None
+        results = Results(self.config, tables, self.audit.logs(), self.flows, memory)
+        if self.config.write_output:
+            # Audit tables are already written to output folder
+            results.save(save_logs=False)
         print('\nEnd. Model run in %d seconds' % (self.end_time - self.start_time))
+        return results
 
     def new_admission_process(self):
         while True:
             self.network.admissions += 1
             self.network.bed_count += 1
             self.network.deliveries += 1
+            # Common random numbers keyed by arrival (delivery) index
+            draws = None
+            if self.streams is not None:
+                draws = self.streams.arrival(self.network.deliveries - 1)
             p = Patient(data=self.data, id=self.network.admissions,
                         delivery=self.network.deliveries,
                         time_in=self.env.now,
-                        year=Glob_vars.year)
-            p.set_care_requirements(self.data)
+                        year=self.clock.year,
+                        draws=draws,
+                        lsoa_weights=self.lsoa_weights,
+                        lsoa_cumulative_weights=self.lsoa_cumulative_weights)
+            p.set_care_requirements(self.data, draws)
             self.network.patients[p.id] = p
             # self.spell = self.spell_gen_process(p)
             self.env.process(self.spell_gen_process(p))
-            next_admission = np.random.exponential(Glob_vars.interarrival_time)
+            if self.arrival_profile is not None:
+                # Time-varying arrival rate
+                _standard_exponential = (draws.interarrival if draws is not None
+                                         else np.random.standard_exponential())
+                next_admission = self.arrival_profile.next_arrival_time(
+                    self.env.now, _standard_exponential) - self.env.now
+            elif draws is not None:
+                next_admission = draws.interarrival * self.config.interarrival_time
+            else:
+                next_admission = np.random.exponential(self.config.interarrival_time)
             # print('Next patient in %f3.2' %next_p)
-            if p.fetuses > 1:  # Copy twins etc
-                for extra_fetus in range(p.fetuses - 1):
-                    # Twins are always same category, but actual lengths of stay are sampled separately
-                    p2 = copy.deepcopy(p)
-                    p2.category = p2.category_without_surgery  # does not duplicate surgery, resets to category before surgery
-                    p2.set_care_requirements(self.data)
+            if p.fetuses > 1:  # Add twins etc
+                # Twins are always same category (before surgery), but surgery, pathway and
+                # lengths of stay are sampled separately
+                for p2 in p.create_siblings(self.data, self.network.admissions + 1, draws):
                     self.network.admissions += 1
                     self.network.bed_count += 1
-                    p2.id = self.network.admissions
                     self.network.patients[p2.id] = p2
                     self.env.process(self.spell_gen_process(p2))
             yield self.env.timeout(next_admission)
@@ -257,65 +371,23 @@ class Model:
             for _displaced_patient_id in self.network.displaced_patients_ids:
                 _displaced_patient = self.network.patients[_displaced_patient_id]
                 # Check if capacity available in
-                _required_nurse_resources = Glob_vars.nurse_for_care_level[
+                _required_nurse_resources = self.config.nurse_for_care_level[
                     _displaced_patient.required_care_level_current]
                 _closest_appropriate_hospital = _displaced_patient.closest_appropriate_hospital
                 _capacity_at_closest_appropriate_hospital = (
                     (self.network.status['nursing_capacity'].loc[_closest_appropriate_hospital] *
-                     Glob_vars.allowed_overload_fraction) -
+                     self.config.allowed_overload_fraction) -
                     self.network.status['current_workload'].loc[_closest_appropriate_hospital])
 
                 if _capacity_at_closest_appropriate_hospital >= _required_nurse_resources:
                     # *** Capacity at closest appropraite unit now exists. Transfer patient ***
-                    _current_hopsital = _displaced_patient.current_hospital
+                    _old_hospital = _displaced_patient.current_hospital
+                    self.relocate_patient(_displaced_patient, _closest_appropriate_hospital,
+                                          _required_nurse_resources)
 
-                    _transfer_to_hospital = _closest_appropriate_hospital
-
-                    _displaced_patient._current_hopsital = _closest_appropriate_hospital
-                    self.transfer_patient(_current_hopsital, _transfer_to_hospital,
-                                          _displaced_patient)
-
-                    _displaced_patient.previous_hospital = _current_hopsital
-
-                    # Adjust hospital tracking
-
-                    _old_hospital = _current_hopsital
-                    _new_hospital = _closest_appropriate_hospital
-
-                    # Remove nursing resources from 'old hospital'
-                    _new_value = self.network.status.loc[_old_hospital][
-                                     'current_workload'] - _required_nurse_resources
-                    self.network.status.set_value(_old_hospital, 'current_workload', _new_value)
-
-                    # Remove from old hospital care level count
-                    _network_col = Glob_vars.network_count_columns[
-                        _displaced_patient.required_care_level_current]
-                    _new_value = self.network.status.loc[_old_hospital][_network_col] - 1
-                    self.network.status.set_value(_old_hospital, _network_col, _new_value)
-
-                    # Remove from old hospital all infants count
-                    _new_value = self.network.status.loc[_old_hospital]['all_infants'] - 1
-                    self.network.status.set_value(_old_hospital, 'all_infants', _new_value)
-
-                    # Add to nursing resources from 'new hospital'
-                    _new_value = self.network.status.loc[_new_hospital][
-                                     'current_workload'] + _required_nurse_resources
-                    self.network.status.set_value(_new_hospital, 'current_workload', _new_value)
-
-                    # Add to new hospital care level count
-                    _network_col = Glob_vars.network_count_columns[
-                        _displaced_patient.required_care_level_current]
-                    _new_value = self.network.status.loc[_new_hospital][_network_col] + 1
-                    self.network.status.set_value(_new_hospital, _network_col, _new_value)
-
-                    # Add to new hospital all infants count
-                    _new_value = self.network.status.loc[_new_hospital]['all_infants'] + 1
-                    self.network.status.set_value(_new_hospital, 'all_infants', _new_value)
-
-                    # Update patient object distance from home and record now in closest appropriate hospital
-                    _displaced_patient.distance_from_home = self.data.travel_tuples[
-                        (_displaced_patient.lsoa, _closest_appropriate_hospital)]
-                    _displaced_patient.in_closest_appropriate_hospital = True
+                    # Capacity freed at old hospital; admit any infants waiting for it
+                    if self.config.use_admission_queues:
+                        self.admit_from_queues(_old_hospital)
                 else:
                     # Patient not moved; a new list of patients not relocated is built
                     _new_displaced_list_ids.append(_displaced_patient.id)
@@ -326,6 +398,49 @@ class Model:
             # trigger while loop to resule in 1 day
             yield self.env.timeout(1)
 
+    def relocate_patient(self, p, hospital, _required_nurse_resources):
+        """Move displaced patient to hospital (closest appropriate): transfer, update hospital
+        tracking and patient location"""
+        _old_hospital = p.current_hospital
+        self.transfer_patient(_old_hospital, hospital, p)
+
+        # Remove nursing resources from 'old hospital'
+        _new_value = self.network.status.loc[_old_hospital][
+                         'current_workload'] - _required_nurse_resources
+        self.network.status.set_value(_old_hospital, 'current_workload', _new_value)
+
+        # Remove from old hospital care level count
+        _network_col = self.network_count_columns[p.required_care_level_current]
+        _new_value = self.network.status.loc[_old_hospital][_network_col] - 1
+        self.network.status.set_value(_old_hospital, _network_col, _new_value)
+
+        # Remove from old hospital all infants count
+        _new_value = self.network.status.loc[_old_hospital]['all_infants'] - 1
+        self.network.status.set_value(_old_hospital, 'all_infants', _new_value)
+
+        # Add to nursing resources from 'new hospital'
+        _new_value = self.network.status.loc[hospital][
+                         'current_workload'] + _required_nurse_resources
+        self.network.status.set_value(hospital, 'current_workload', _new_value)
+
+        # Add to new hospital care level count
+        _new_value = self.network.status.loc[hospital][_network_col] + 1
+        self.network.status.set_value(hospital, _network_col, _new_value)
+
+        # Add to new hospital all infants count
+        _new_value = self.network.status.loc[hospital]['all_infants'] + 1
+        self.network.status.set_value(hospital, 'all_infants', _new_value)
+
+        # Set hospital on patient object (spell ends, and next spell starts, from new hospital)
+        p.current_hospital = hospital
+        p.current_network = self.data.network_lookup.loc[p.current_hospital].item()
+        p.in_home_network = 1 if p.current_network == p.home_network else 0
+        p.previous_hospital = hospital
+
+        # Update patient object distance from home and record now in closest appropriate hospital
+        self.set_distance_from_home(p, hospital)
+        p.in_closest_appropriate_hospital = True
+
     def spell_gen_process(self, p):  # patient event generator
         # do a while loop here to go through stages of care
         while p.complete == False:
@@ -342,32 +457,31 @@ class Model:
                     yield self.env.timeout(_los)
 
                     # End of spell
-
-                    # Adjust hospital tracking at end of spell
-
-                    # Remove nurse workload
-                    _required_nurse_resources = Glob_vars.nurse_for_care_level[
-                        p.required_care_level_current]
-                    _new_value = self.network.status['current_workload'].loc[
-                                     p.current_hospital] - _required_nurse_resources
-                    self.network.status.set_value(p.current_hospital, 'current_workload',
-                                                  _new_value)
-
-                    # Remove from care level tracking
-                    _network_col = Glob_vars.network_count_columns[p.required_care_level_current]
-                    _new_value = self.network.status.loc[p.current_hospital][_network_col] - 1
-                    self.network.status.set_value(p.current_hospital, _network_col, _new_value)
-
-                    # Remove from hospital all infants count
-                    _new_value = self.network.status.loc[p.current_hospital]['all_infants'] - 1
-                    self.network.status.set_value(p.current_hospital, 'all_infants', _new_value)
-
-                    # remove from displaced patients if present
-                    if p.id in self.network.displaced_patients_ids:
-                        self.network.displaced_patients_ids.remove(p.id)
+                    self.end_spell(p)
+                elif (self.config.use_admission_queues and
+                      p.closest_appropriate_hospital != 'None'):
+                    # No bed found. Wait in admission queue at closest appropriate unit. If not
+                    # admitted by end of LoS the episode is recorded as having no bed.
+                    _admitted = self.env.event()
+                    _queue_entry = self.queue_for_bed(p, _admitted)
+                    _queue_start = self.env.now
+                    yield _admitted | self.env.timeout(_los)
+                    if _admitted.triggered:
+                        # Admitted from queue; remaining LoS in hospital
+                        _wait = self.env.now - _queue_start
+                        self.audit.admissions_from_queue += 1
+                        self.audit.total_queue_wait += _wait
+                        yield self.env.timeout(_los - _wait)
+                        self.end_spell(p)
+                    else:
+                        # Leave queue (entry is removed when it reaches front of queue)
+                        _queue_entry[3] = None
+                        self.network.queued -= 1
+                        self.audit.total_queue_wait += _los
+                        self.audit.episodes_with_no_bed_found += 1
+                        self.audit.total_episodes_length_with_no_bed_found += _los
                 else:
                     # No bed found. Model tracks missing episodes and LoS
-                    print('No Bed found')
                     self.audit.episodes_with_no_bed_found += 1
                     self.audit.total_episodes_length_with_no_bed_found += _los
                     yield self.env.timeout(_los)
@@ -377,16 +491,82 @@ class Model:
         self.network.bed_count -= 1
         p.time_out = self.env.now
 
-        if self.env.now > Glob_vars.warm_up:
-            self.audit.record_patient_log(p, Glob_vars.output_folder)
+        if self.env.now > self.config.warm_up:
+            self.audit.record_patient_log(p)
 
         del self.network.patients[p.id]
         del p
 
+    def end_spell(self, p):
+        """Adjust hospital tracking at end of spell"""
+        # Remove nurse workload
+        _required_nurse_resources = self.config.nurse_for_care_level[
+            p.required_care_level_current]
+        _new_value = self.network.status['current_workload'].loc[
+                         p.current_hospital] - _required_nurse_resources
+        self.network.status.set_value(p.current_hospital, 'current_workload', _new_value)
+
+        # Remove from care level tracking
+        _network_col = self.network_count_columns[p.required_care_level_current]
+        _new_value = self.network.status.loc[p.current_hospital][_network_col] - 1
+        self.network.status.set_value(p.current_hospital, _network_col, _new_value)
+
+        # Remove from hospital all infants count
+        _new_value = self.network.status.loc[p.current_hospital]['all_infants'] - 1
+        self.network.status.set_value(p.current_hospital, 'all_infants', _new_value)
+
+        # remove from displaced patients if present
+        if p.id in self.network.displaced_patients_ids:
+            self.network.displaced_patients_ids.remove(p.id)
+
+        # Capacity freed; admit any infants waiting for this hospital
+        if self.config.use_admission_queues:
+            self.admit_from_queues(p.current_hospital)
+
+    def queue_for_bed(self, p, admitted):
+        """Add patient to admission queue for required unit type at closest appropriate
+        hospital. Queue priority is by care level (surgery first) then time of joining queue.
+        Returns queue entry [care level, time, sequence, patient, admitted event]."""
+        _queue_key = (p.closest_appropriate_hospital, p.required_unit_type)
+        self.network.queue_sequence += 1
+        _queue_entry = [p.required_care_level_current, self.env.now,
+                        self.network.queue_sequence, p, admitted]
+        heapq.heappush(self.network.admission_queues.setdefault(_queue_key, []), _queue_entry)
+        self.network.queued += 1
+        return _queue_entry
+
+    def admit_from_queues(self, hospital):
+        """Admit waiting infants (highest priority first) while hospital has capacity. Called
+        when capacity at the hospital is freed, so only this hospital's queues are checked."""
+        for _unit_type in range(5):
+            _queue = self.network.admission_queues.get((hospital, _unit_type))
+            while _queue:
+                _queue_entry = _queue[0]
+                _waiting_patient = _queue_entry[3]
+                if _waiting_patient is None:
+                    # Patient has left queue
+                    heapq.heappop(_queue)
+                    continue
+                _required_nurse_resources = self.config.nurse_for_care_level[
+                    _waiting_patient.required_care_level_current]
+                _hospital_capacity = ((self.network.status['nursing_capacity'].loc[hospital] *
+                                       self.config.allowed_overload_fraction) -
+                                      self.network.status['current_workload'].loc[hospital])
+                if _hospital_capacity < _required_nurse_resources:
+                    break
+                heapq.heappop(_queue)
+                self.network.queued -= 1
+                self.admit_patient(_waiting_patient, hospital, _required_nurse_resources)
+                _queue_entry[4].succeed()
+
     def transfer_patient(self, from_hospital, to_hospital, p):
-        _transfer_distance = self.data.interhospital_distance_tuples[
-            (from_hospital, to_hospital)]
-        _transfer_time = self.data.interhospital_time_tuples[(from_hospital, to_hospital)]
+        _from = self.data.hospital_index[from_hospital]
+        _to = self.data.hospital_index[to_hospital]
+        _transfer_distance = self.data.interhospital_distance[_from, _to]
+        _transfer_time = self.data.interhospital_time[_from, _to]
+        if self.env.now >= self.config.warm_up:
+            self.flows.record_transfer(from_hospital, to_hospital,
+                                       p.required_care_level_current, self.clock.year)
         self.audit.transfers += 1
         self.audit.total_transfer_distance += _transfer_distance
         self.audit.total_transfer_time += _transfer_time
@@ -394,11 +574,27 @@ class Model:
         p.transfers += 1
 
 
-def main():
-    random.seed(1)  # remove number to have different random seed each time
-    model = Model()
-    model.model_run()
+def run_replication(config, replication, seed, output_folder):
+    """Run one model replication with its own seed and output folder (run in a fresh process,
+    e.g. by ReplicationController with functools.partial(run_replication, config)). With common
+    random numbers the replication number is added to the CRN seed, so replication n of two
+    scenarios uses the same arrivals."""
+    config = config._replace(output_folder=output_folder)
+    if config.crn_seed is not None:
+        config = config._replace(crn_seed=(config.crn_seed, replication))
+    random.seed(seed)
+    np.random.seed(seed)
+    model = Model(config)
+    model.run()
+    return output_folder
+
+
+def main(args=None):
+    """Command line interface (see neonet_modules.cli). With no command, runs the model."""
+    # Imported here as the command line interface module imports this module
+    from neonet_modules.cli import main as cli_main
+    return cli_main(args)
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""National neonatal demand and capacity model
+*** Requires Python 3.6 or greater***
+
+Class to describe time-varying arrival rates
+
+Version 170601
+
+(c)2017 Michael Allen
+This code is distributed under GNU GPL2
+https://www.gnu.org/licenses/old-licenses/gpl-2.0.en.html
+For info contact michael.allen1966@gmail.com
+"""
+
+import numpy as np
+
+
+class ArrivalProfile:
+    """Arrival rate (per day) varying by season, weekday and annual growth, with optional growth
+    by region"""
+
+    def __init__(self, arrivals_per_day, monthly_factors=None, seasonal_amplitude=0.0,
+                 seasonal_peak_day=0, weekday_factors=None, annual_growth=0.0,
+                 region_growth=None):
+        self.arrivals_per_day = arrivals_per_day
+        self.monthly_factors = None
+        if monthly_factors is not None:
+            self.monthly_factors = np.array(monthly_factors, dtype=np.float64)
+            self.monthly_factors /= self.monthly_factors.mean()
+        self.seasonal_amplitude = seasonal_amplitude
+        self.seasonal_peak_day = seasonal_peak_day
+        self.weekday_factors = None
+        if weekday_factors is not None:
+            self.weekday_factors = np.array(weekday_factors, dtype=np.float64)
+            self.weekday_factors /= self.weekday_factors.mean()
+        self.annual_growth = annual_growth
+        self.region_growth = region_growth
+        self.rates = {}
+
+    def rate(self, day):
+        """Arrivals per day on (whole) model day"""
+        if day in self.rates:
+            return self.rates[day]
+
+        day_of_year = day % 365
+        rate = self.arrivals_per_day
+        if self.monthly_factors is not None:
+            rate *= self.monthly_factors[int(day_of_year * 12 / 365)]
+        elif self.seasonal_amplitude:
+            rate *= 1 + self.seasonal_amplitude * np.cos(
+                2 * np.pi * (day_of_year - self.seasonal_peak_day) / 365)
+        if self.weekday_factors is not None:
+            rate *= self.weekday_factors[day % 7]
+        rate *= (1 + self.annual_growth) ** int(day / 365)
+
+        self.rates[day] = rate
+        return rate
+
+    def next_arrival_time(self, now, standard_exponential):
+        """Time of next arrival after now, from one standard exponential random number"""
+        time = now
+        remaining = standard_exponential
+        while True:
+            day = int(time)
+            rate = self.rate(day)
+            expected_to_day_end = (day + 1 - time) * rate
+            if remaining < expected_to_day_end:
+                return time + remaining / rate
+            remaining -= expected_to_day_end
+            time = day + 1
+
+    def lsoa_weights(self, data, year):
+        """LSOA demand weights with region growth applied for model year (1 = first year), or
+        None if no region growth"""
+        if not self.region_growth:
+            return None
+        growth = data.lsoa_demand['SOA'].map(self.region_growth).fillna(0.0)
+        return data.lsoa_demand['all_neonatal'] * (1 + growth) ** (year - 1)
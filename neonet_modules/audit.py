@@ -12,30 +12,182 @@ For info contact michael.allen1966@gmail.com
 """
 
 
+import numpy as np
 import pandas as pd
+import math
 import os
 import csv
+import queue
+import random
+import threading
 import time
 
 
 # Todo add lengths of stay at each level and calaculate total length of stay from time in and time out
 
-class Audit():
+class CsvSink:
+    """Audit sink appending each audit table to a CSV file (table name + '.csv') in
+    output_folder"""
+
+    def __init__(self, output_folder):
+        self.output_folder = output_folder
+        # First check output folder exists. If not, make it.
+        if not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+
+    def filename(self, table):
+        return self.output_folder + '/' + table + '.csv'
+
+    def set_up(self, table, headers):
+        with open(self.filename(table), "w") as output:
+            writer = csv.writer(output, lineterminator='\n')
+            writer.writerow(headers)
+
+    def write_rows(self, table, rows):
+        with open(self.filename(table), "a") as output:
+            writer = csv.writer(output, lineterminator='\n')
+            writer.writerows(rows)
+
+    def write_frame(self, table, df):
+        with open(self.filename(table), 'a') as f:
+            df.to_csv(f, header=False)
+
+    def read(self, table):
+        return pd.read_csv(self.filename(table))
+
+    def close(self):
+        pass
+
+
+class BackgroundSink:
+    """Audit sink passing writes to another sink (e.g. CsvSink) in a background writer thread"""
+
+    def __init__(self, sink, max_queue=1000):
+        self.sink = sink
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.error = None
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+    def writer(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                function, args = item
+                if self.error is None:
+                    function(*args)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def put(self, function, *args):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((function, args))
+
+    def set_up(self, table, headers):
+        self.put(self.sink.set_up, table, headers)
+
+    def write_rows(self, table, rows):
+        self.put(self.sink.write_rows, table, rows)
+
+    def write_frame(self, table, df):
+        columns = {column: df[column].values.copy() for column in df.columns}
+        self.put(self.write_frame_arrays, table, df.index.values.copy(), df.index.name,
+                 columns)
+
+    def write_frame_arrays(self, table, index, index_name, columns):
+        """Rebuild audited frame from copied arrays (in writer thread)"""
+        df = pd.DataFrame(columns, index=pd.Index(index, name=index_name))
+        self.sink.write_frame(table, df)
+
+    def flush(self):
+        # A thread started before a fork (e.g. optimiser evaluation) does not run in the
+        # forked process, and writes queued there are never completed
+        if self.thread.is_alive():
+            self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def read(self, table):
+        self.flush()
+        return self.sink.read(table)
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+class MemorySink:
+    """Audit sink keeping each audit table in memory (read back as a DataFrame)"""
+
     def __init__(self):
+        self.headers = {}
+        self.rows = {}
+
+    def set_up(self, table, headers):
+        self.headers[table] = headers
+        self.rows[table] = []
+
+    def write_rows(self, table, rows):
+        self.rows[table].extend(rows)
+
+    def write_frame(self, table, df):
+        # Copied out, as audited frames (e.g. network status) change after audit
+        self.rows[table].extend(df.reset_index().values.tolist())
+
+    def read(self, table):
+        df = pd.DataFrame(self.rows[table], columns=self.headers[table])
+        # Empty fields are missing values (as in a CSV file read back)
+        return df.replace('', np.nan).infer_objects()
+
+    def close(self):
+        pass
+
+
+class Audit():
+    """Daily audits written to audit sinks (see set_up_output), and counts of all live patients"""
+
+    max_distance_bin = 600
+
+    def __init__(self, config, clock, seed=0):
+        self.config = config
+        self.clock = clock
+        self.sinks = []
+        self.keep_logs = False
         self.transfers = 0
         self.total_transfer_distance = 0
         self.total_transfer_time = 0
         self.episodes_with_no_bed_found = 0
         self.total_episodes_length_with_no_bed_found = 0
+        self.admissions_from_queue = 0
+        self.total_queue_wait = 0
+        self.patient_audit_sampling = config.patient_audit_sampling
+        self.sample_size = config.patient_audit_sample_size
+        self.sample_fraction = config.patient_audit_sample_fraction
+        # Sampling uses its own random stream so model random numbers are not affected (with a
+        # fixed seed so that sampled runs are reproducible)
+        self.sample_random = random.Random(seed)
+        self.distance_from_home_counts = {}
+        self.travel_time_counts = {}
+        self.multiple_birth_counts = {}
 
-    def perform_daily_audit(self, day, year, network, output_folder):
-        self.perform_general_audit(day, year, network, output_folder)
-        self.perform_hospital_audit(day, year, network, output_folder)
+    def perform_daily_audit(self, network):
+        day = self.clock.day
+        year = self.clock.year
+        self.perform_general_audit(day, year, network)
+        self.perform_hospital_audit(day, year, network)
         # Run patient audit every 10 days (default)
         if day % 10 == 0:
-            self.perform_patient_audit(day, year, network, output_folder)
+            self.perform_patient_audit(day, year, network)
 
-    def perform_general_audit(self, day, year, network, output_folder):
+    def perform_general_audit(self, day, year, network):
         data_list = []
         data_list.append(day)
         data_list.append(year)
@@ -47,25 +199,96 @@ class Audit():
         data_list.append(network.status['current_level_4'].sum())  # L4 infants
         data_list.append(network.status['current_workload'].sum())  # Nurse workload
         data_list.append(len(network.displaced_patients_ids))  # displaced infants
+        data_list.append(network.queued)  # infants waiting in admission queues
 
-        my_csv = output_folder + '/general_day_audit.csv'
-        with open(my_csv, "a") as output:
-            writer = csv.writer(output, lineterminator='\n')
-            writer.writerow(data_list)
+        self.write_rows('general_day_audit', [data_list])
 
-    def perform_hospital_audit(self, day, year, network, output_folder):
+    def perform_hospital_audit(self, day, year, network):
         df = network.status
         df['day'] = day
         df['year'] = year
-        my_csv = output_folder + '/hospital_day_audit.csv'
-        with open(my_csv, 'a') as f:
-            df.to_csv(f, header=False)
+        for sink in self.sinks:
+            sink.write_frame('hospital_day_audit', df)
+
+    def count_distance_from_home(self, year, patients):
+        distances = np.fromiter((p.distance_from_home for p in patients), dtype=np.float64,
+                                count=len(patients))
+        # NaN distances are counted in bin 0 (not greater than any threshold)
+        bins = np.ceil(np.nan_to_num(distances)).clip(0, self.max_distance_bin).astype(int)
+        if year not in self.distance_from_home_counts:
+            self.distance_from_home_counts[year] = np.zeros(self.max_distance_bin + 1,
+                                                            dtype=np.int64)
+        self.distance_from_home_counts[year] += np.bincount(
+            bins, minlength=self.max_distance_bin + 1)
+
+    def count_multiple_births(self, year, patients):
+        """Count deliveries with more than one live sibling and those with all in one unit"""
+        hospitals_by_delivery = {}
+        for p in patients:
+            if p.fetuses > 1:
+                hospitals_by_delivery.setdefault(p.delivery_id, []).append(p.current_hospital)
+        if year not in self.multiple_birth_counts:
+            self.multiple_birth_counts[year] = np.zeros(2, dtype=np.int64)
+        counts = self.multiple_birth_counts[year]
+        for hospitals in hospitals_by_delivery.values():
+            if len(hospitals) > 1:
+                counts[0] += 1
+                if len(set(hospitals)) == 1:
+                    counts[1] += 1
+
+    def record_travel_time(self, year, care_level, network, minutes):
+        key = (year, care_level, network)
+        counts = self.travel_time_counts.get(key)
+        if counts is None:
+            counts = np.zeros(self.max_distance_bin + 1, dtype=np.int64)
+            self.travel_time_counts[key] = counts
+        # NaN times are counted in bin 0 (as count_distance_from_home)
+        if math.isnan(minutes):
+            counts[0] += 1
+        else:
+            counts[min(max(math.ceil(minutes), 0), self.max_distance_bin)] += 1
+
+    def reservoir_sample(self, patients, size):
+        """Uniform sample of up to size patients from an iterable in a single pass"""
+        reservoir = []
+        for count, p in enumerate(patients):
+            if count < size:
+                reservoir.append(p)
+            else:
+                replace = self.sample_random.randint(0, count)
+                if replace < size:
+                    reservoir[replace] = p
+        return reservoir
+
+    def sample_patients(self, patients):
+        """Sampled patients and weights (inverse of the probability of sampling a patient)"""
+        if self.patient_audit_sampling == 'all':
+            return [(p, 1.0) for p in patients]
+        elif self.patient_audit_sampling == 'reservoir':
+            sample = self.reservoir_sample(patients, self.sample_size)
+            return [(p, len(patients) / len(sample)) for p in sample]
+        elif self.patient_audit_sampling == 'hash':
+            # Multiplicative hash of id mapped to 0-1
+            return [(p, 1 / self.sample_fraction) for p in patients
+                    if ((p.id * 2654435761) % 2 ** 32) / 2 ** 32 < self.sample_fraction]
+        elif self.patient_audit_sampling == 'stratified':
+            sample = []
+            for care_level in range(5):
+                level_patients = [p for p in patients
+                                  if p.required_care_level_current == care_level]
+                level_sample = self.reservoir_sample(level_patients, self.sample_size)
+                sample += [(p, len(level_patients) / len(level_sample)) for p in level_sample]
+            return sample
+        else:
+            raise ValueError('Unknown patient audit sampling: %s' % self.patient_audit_sampling)
 
-    def perform_patient_audit(self, day, year, network, output_folder):
-        my_csv = output_folder + '/patient_audit.csv'
+    def perform_patient_audit(self, day, year, network):
         patients = []
+        live_patients = list(network.patients.values())
+        self.count_distance_from_home(year, live_patients)
+        self.count_multiple_births(year, live_patients)
 
-        for key, p in network.patients.items():
+        for p, weight in self.sample_patients(live_patients):
             data_list = []
             data_list.append(day)
             data_list.append(year)
@@ -77,17 +300,16 @@ class Audit():
             data_list.append(p.current_hospital)
             data_list.append(p.distance_from_home)
             data_list.append(p.fetuses)
+            data_list.append(p.birth_order)
             data_list.append(p.in_closest_appropriate_hospital)
             data_list.append(p.closest_appropriate_hospital)
             data_list.append(p.in_home_network)
+            data_list.append(weight)
             patients.append(data_list)
 
-        with open(my_csv, "a") as output:
-            writer = csv.writer(output, lineterminator='\n')
-            writer.writerows(patients)
+        self.write_rows('patient_audit', patients)
 
-    def record_patient_log(self, p, output_folder):
-        my_csv = output_folder + '/patient_log.csv'
+    def record_patient_log(self, p):
         patient = []
         patient.append(p.time_in)
         patient.append(p.year)
@@ -97,6 +319,7 @@ class Audit():
         patient.append(p.delivery_id)
         patient.append(p.entry)
         patient.append(p.fetuses)
+        patient.append(p.birth_order)
         patient.append(p.id)
         patient.append(p.lsoa)
         patient.append(p.spells)
@@ -113,17 +336,25 @@ class Audit():
         patient.append(p.time_out)
         patient.append(p.time_out - p.time_in)
 
-        with open(my_csv, "a") as output:
-            writer = csv.writer(output, lineterminator='\n')
-            writer.writerow(patient)
+        self.write_rows('patient_log', [patient])
 
-    def set_up_output(self, output_folder):
-        # First check output folder exists. If not, make it.
-        if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
+    def set_up_output(self, output_folder=None, keep_logs=False):
+        """Write audit tables to CSV files in output_folder (if given) and/or keep them in
+        memory (if keep_logs, or if there is no output folder). CSV files are written by a
+        background thread if Config audit_writer_queue is set."""
+        self.close()
+        self.sinks = []
+        self.keep_logs = keep_logs
+        if output_folder is not None:
+            if self.config.audit_writer_queue:
+                self.sinks.append(BackgroundSink(CsvSink(output_folder),
+                                                 max_queue=self.config.audit_writer_queue))
+            else:
+                self.sinks.append(CsvSink(output_folder))
+        if keep_logs or output_folder is None:
+            self.sinks.append(MemorySink())
 
         # Set up general audit
-        filename = output_folder + '/general_day_audit.csv'
         headers = ['day',
                    'year',
                    'all infants',
@@ -133,8 +364,9 @@ class Audit():
                    'level_3',
                    'level_4',
                    'nurse_workload',
-                   'displaced']
-        self.write_file(filename, headers)
+                   'displaced',
+                   'queued']
+        self.set_up_table('general_day_audit', headers)
 
         # Set up patient audit
 
@@ -148,11 +380,12 @@ class Audit():
                    'hospital',
                    'distance_from_home',
                    'fetuses',
+                   'birth_order',
                    'in_closest_suitable_unit',
                    'closest_suitable_unit',
-                   'in_home_network']
-        filename = output_folder + '/patient_audit.csv'
-        self.write_file(filename, headers)
+                   'in_home_network',
+                   'weight']
+        self.set_up_table('patient_audit', headers)
 
         # Set up patient log
 
@@ -164,6 +397,7 @@ class Audit():
                    'delivery_id',
                    'entry',
                    'fetuses',
+                   'birth_order',
                    'id',
                    'lsoa',
                    'spells',
@@ -177,8 +411,7 @@ class Audit():
                    'time_out',
                    'total_los']
 
-        filename = output_folder + '/patient_log.csv'
-        self.write_file(filename, headers)
+        self.set_up_table('patient_log', headers)
 
         # Set up hospital audit
 
@@ -194,10 +427,36 @@ class Audit():
                    'day',
                    'year']
 
-        filename = output_folder + '/hospital_day_audit.csv'
-        self.write_file(filename, headers)
+        self.set_up_table('hospital_day_audit', headers)
 
-    def write_file(self, filename, headers):
-        with open(filename, "w") as output:
-            writer = csv.writer(output, lineterminator='\n')
-            writer.writerow(headers)
+    def set_up_table(self, table, headers):
+        for sink in self.sinks:
+            sink.set_up(table, headers)
+
+    def write_rows(self, table, rows):
+        for sink in self.sinks:
+            sink.write_rows(table, rows)
+
+    def close(self):
+        """Complete all audit writes"""
+        for sink in self.sinks:
+            sink.close()
+
+    def memory_sink(self):
+        for sink in self.sinks:
+            if isinstance(sink, MemorySink):
+                return sink
+        return None
+
+    def read_table(self, table):
+        """Audit table as DataFrame (from memory if kept, otherwise from CSV file)"""
+        sink = self.memory_sink()
+        return sink.read(table) if sink is not None else self.sinks[0].read(table)
+
+    def logs(self):
+        """All audit tables, as DataFrames, if kept (keep_logs), otherwise empty. Tables held
+        in memory only to be summarised (no output folder) are not returned."""
+        sink = self.memory_sink()
+        if not self.keep_logs or sink is None:
+            return {}
+        return {table: sink.read(table) for table in sink.headers}
@@ -0,0 +1,231 @@
+"""National neonatal demand and capacity model
+*** Requires Python 3.6 or greater***
+
+Command line interface
+
+Version 170601
+
+(c)2017 Michael Allen
+This code is distributed under GNU GPL2
+https://www.gnu.org/licenses/old-licenses/gpl-2.0.en.html
+For info contact michael.allen1966@gmail.com
+
+Usage (from the model folder):
+    python neonet.py run --profile quick
+    python neonet.py run --profile national --replications 10 --workers 8
+    python neonet.py run --config scenario.json --set arrivals_per_day=250
+    python neonet.py sweep --profile standard --vary arrivals_per_day=[200,228,250]
+    python neonet.py summarise output/standard
+    python neonet.py bench
+
+With no command, 'run' is used (so 'python neonet.py --set name=value' runs as before).
+Profiles (see Config.profiles) cache loaded data in output/data_cache, so data is loaded
+from input files only when they change.
+"""
+
+import argparse
+import functools
+import itertools
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from neonet import Model, run_replication
+from neonet_modules.config import Config
+from neonet_modules.data import Data
+from neonet_modules.regression import make_fixtures, run_scenarios
+from neonet_modules.replication import ReplicationController
+from neonet_modules.summarise import Summarise
+
+commands = ['run', 'sweep', 'bench', 'summarise']
+
+
+def configure(parsed):
+    """Configuration from parsed arguments, with --output-format and --cache-dir applied"""
+    config = Config.from_parsed_args(parsed)
+    if parsed.output_format is not None:
+        config = config._replace(output_format=parsed.output_format)
+    if parsed.cache_dir is not None:
+        config = config._replace(data_cache_folder=parsed.cache_dir)
+    return config
+
+
+def run(parsed):
+    """Single run in this process, or replications in parallel worker processes (each
+    replication in a subfolder of the output folder)"""
+    config = configure(parsed)
+    if parsed.replications == 1:
+        random.seed(parsed.seed)
+        np.random.seed(parsed.seed)
+        Model(config).run()
+        return 0
+
+    controller = ReplicationController(functools.partial(run_replication, config),
+                                       config.output_folder, workers=parsed.workers,
+                                       min_replications=parsed.replications,
+                                       max_replications=parsed.replications,
+                                       base_seed=parsed.seed)
+    controller.run()
+    return 0
+
+
+def sweep(parsed):
+    """
+    Run every combination of --vary settings (replications of each) in parallel worker
+    processes. Scenario settings are saved in sweep_scenarios.csv and outputs in
+    scenario_NNN/replication_NNN subfolders of the output folder. Replication n of each
+    scenario uses the same seed.
+    """
+    config = configure(parsed)
+    names = []
+    values = []
+    for vary in parsed.vary:
+        name, value = Config.parse_setting(vary)
+        if not isinstance(value, list):
+            raise ValueError('--vary values must be a JSON list, e.g. %s=[1,2]' % name)
+        names.append(name)
+        values.append(value)
+
+    scenarios = pd.DataFrame(list(itertools.product(*values)), columns=names)
+    scenarios.index.name = 'scenario'
+    tasks = []
+    for scenario, settings in enumerate(scenarios.to_dict('records')):
+        scenario_config = Config.from_dict(dict(config.to_dict(), **settings))
+        for replication in range(parsed.replications):
+            folder = '%s/scenario_%03d/replication_%03d' % (config.output_folder, scenario,
+                                                              replication)
+            tasks.append((scenario_config, replication, parsed.seed + replication, folder))
+
+    if not os.path.exists(config.output_folder):
+        os.makedirs(config.output_folder)
+    scenarios.to_csv(config.output_folder + '/sweep_scenarios.csv')
+    print('Sweep: %d scenarios x %d replications' % (len(scenarios), parsed.replications))
+
+    workers = parsed.workers if parsed.workers else multiprocessing.cpu_count()
+    with multiprocessing.Pool(processes=workers, maxtasksperchild=1) as pool:
+        pool.starmap(run_replication, tasks)
+    summarise_outputs(config.output_folder)
+    return 0
+
+
+def summarise_outputs(folder):
+    """
+    Collect key outputs (see ReplicationController.read_outputs) of all runs saved in folder
+    and its subfolders into key_outputs.csv. For a sweep, also save mean and standard
+    deviation across replications of each scenario (with scenario settings) in
+    sweep_summary.csv.
+    """
+    outputs = []
+    for path, _, files in sorted(os.walk(folder)):
+        if not {'summary_general.csv', 'summary_general.parquet'} & set(files):
+            continue
+        run_outputs = ReplicationController.read_outputs(path)
+        run_outputs['run'] = os.path.relpath(path, folder)
+        outputs.append(run_outputs)
+    if not outputs:
+        print('No model outputs found in %s' % folder)
+        return None
+
+    outputs = pd.DataFrame(outputs).set_index('run')
+    outputs.to_csv(folder + '/key_outputs.csv')
+    print('\nKey outputs:')
+    print(outputs.to_string())
+
+    if os.path.exists(folder + '/sweep_scenarios.csv'):
+        scenarios = pd.read_csv(folder + '/sweep_scenarios.csv', index_col='scenario')
+        scenario = outputs.index.str.extract(r'scenario_(\d+)', expand=False).astype(int)
+        by_scenario = outputs.groupby(scenario.values).agg(['mean', 'std'])
+        by_scenario.columns = ['%s_%s' % column for column in by_scenario.columns]
+        summary = scenarios.join(by_scenario)
+        summary.to_csv(folder + '/sweep_summary.csv')
+        print('\nSweep summary:')
+        print(summary.to_string())
+    return outputs
+
+
+def summarise(parsed):
+    summarise_outputs(parsed.folder)
+    return 0
+
+
+def bench(parsed):
+    """Time data loading (from input files and from cache) and model runs of the regression
+    scenarios on synthetic data"""
+    make_fixtures(parsed.fixtures)
+    if not os.path.exists(parsed.output):
+        os.makedirs(parsed.output)
+    cache_folder = parsed.cache_dir if parsed.cache_dir else parsed.output + '/data_cache'
+    load_timings = pd.Series(name='seconds')
+    for source, folder in [('files', None), ('cache (first load)', cache_folder),
+                           ('cache', cache_folder)]:
+        start = time.perf_counter()
+        Data.load(False, parsed.fixtures, cache_folder=folder)
+        load_timings[source] = time.perf_counter() - start
+    load_timings.to_csv(parsed.output + '/load_timings.csv', index_label='source')
+
+    timings = run_scenarios(parsed.fixtures, parsed.output)
+    print('\nData load (seconds):')
+    print(load_timings.to_string())
+    print('\nScenario timings (seconds):')
+    print(timings.to_string())
+    return 0
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='National neonatal demand and capacity model')
+    subparsers = parser.add_subparsers(dest='command')
+
+    # Options shared by commands which run the model
+    model_options = argparse.ArgumentParser(add_help=False)
+    Config.add_arguments(model_options)
+    model_options.add_argument('--workers', type=int, default=None,
+                               help='worker processes for replications (default all CPUs)')
+    model_options.add_argument('--replications', type=int, default=1,
+                               help='replications (run in parallel if more than one)')
+    model_options.add_argument('--seed', type=int, default=1,
+                               help='random seed (of first replication)')
+    model_options.add_argument('--output-format', choices=Summarise.output_formats,
+                               help='summary table format (parquet requires pyarrow)')
+    model_options.add_argument('--cache-dir',
+                               help='folder for cached loaded data (see Data.load)')
+
+    run_parser = subparsers.add_parser('run', parents=[model_options],
+                                       help='run model (or replications)')
+    run_parser.set_defaults(function=run)
+
+    sweep_parser = subparsers.add_parser('sweep', parents=[model_options],
+                                         help='run all combinations of settings')
+    sweep_parser.add_argument('--vary', action='append', required=True,
+                              metavar='NAME=[VALUE,...]',
+                              help='setting and JSON list of values to sweep')
+    sweep_parser.set_defaults(function=sweep)
+
+    bench_parser = subparsers.add_parser('bench', help='time data loading and model runs')
+    bench_parser.add_argument('--output', default='output/bench',
+                              help='folder for benchmark outputs')
+    bench_parser.add_argument('--fixtures', default='output/bench/fixtures',
+                              help='folder for synthetic data')
+    bench_parser.add_argument('--cache-dir', help='folder for cached loaded data')
+    bench_parser.set_defaults(function=bench)
+
+    summarise_parser = subparsers.add_parser('summarise',
+                                             help='collect key outputs of saved runs')
+    summarise_parser.add_argument('folder', help='output folder of run or sweep')
+    summarise_parser.set_defaults(function=summarise)
+
+    if args is None:
+        args = sys.argv[1:]
+    # Default command is run
+    if not args or args[0] not in commands + ['-h', '--help']:
+        args = ['run'] + list(args)
+    parsed = parser.parse_args(args)
+    return parsed.function(parsed)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""National neonatal demand and capacity model
+*** Requires Python 3.6 or greater***
+
+Classes to describe run configuration and model clock
+
+Version 170601
+
+(c)2017 Michael Allen
+This code is distributed under GNU GPL2
+https://www.gnu.org/licenses/old-licenses/gpl-2.0.en.html
+For info contact michael.allen1966@gmail.com
+"""
+
+import argparse
+import json
+from typing import NamedTuple
+
+
+class Config(NamedTuple):
+    """
+    Immutable run configuration. Each Model holds its own Config (and Clock), so several
+    models may exist in one process, and configurations pickle cheaply to worker processes.
+
+    Create with keyword arguments, from a dictionary, JSON or YAML (requires PyYAML), or from
+    command line arguments. Use _replace to derive a changed configuration, e.g.:
+        config = Config.from_file('scenario.json')._replace(output_folder='output/a')
+
+    arrival_profile is None (constant arrival rate) or a dictionary of ArrivalProfile
+    keyword arguments (other than arrivals_per_day).
+
+    Named profiles (Config.profiles) give settings for quick (code testing, truncated data),
+    standard (3 years) and national (10 years) runs.
+    """
+
+    truncate_data: bool = False  # use True for code testing only: results will not be correct
+    data_folder: str = 'data'
+    data_cache_folder: str = None  # folder for pickled loaded data (see Data.load)
+    warm_up: int = 366
+    duration: int = 365 * 10  # sim duration after warm-up
+    arrivals_per_day: float = 228
+    arrival_profile: dict = None  # optional time-varying arrival rate (see ArrivalProfile)
+    nurse_for_care_level: tuple = (1, 1, 0.5, 0.25, 0.125)  # Nurse requirements surgery --> TC
+    allowed_overload_fraction: float = 1.5  # allowed fraction of BAPM guidelines allowed
+    use_admission_queues: bool = False  # queue infants with no bed at closest appropriate unit
+    crn_seed: object = None  # integer (or tuple) seed to use common random numbers for arrivals
+    output_folder: str = 'output/test2'
+    write_output: bool = True  # write audits and summaries to output_folder
+    output_format: str = 'csv'  # summary tables as 'csv' or 'parquet' (requires pyarrow)
+    keep_logs: bool = False  # keep audit tables in memory (returned in Results logs)
+    audit_writer_queue: int = 0  # if > 0, write audit files in background (max queued writes)
+    patient_audit_sampling: str = 'all'  # 'all', 'reservoir', 'hash' or 'stratified'
+    patient_audit_sample_size: int = 1000  # patients per audit day (per care level if stratified)
+    patient_audit_sample_fraction: float = 0.1  # fraction of patients kept by hash sampling
+    progress_interval: float = 5  # minimum wall-clock seconds between progress reports
+    progress_file: str = None  # optional JSON-lines file for progress metrics
+    progress_address: tuple = None  # optional local (host, port) for UDP progress metrics
+    memory_interval: float = None  # days between memory samples (see MemoryMonitor); slow
+
+    profiles = {'quick': {'truncate_data': True, 'warm_up': 30, 'duration': 180,
+                          'data_cache_folder': 'output/data_cache',
+                          'output_folder': 'output/quick'},
+                'standard': {'warm_up': 366, 'duration': 365 * 3,
+                             'data_cache_folder': 'output/data_cache',
+                             'output_folder': 'output/standard'},
+                'national': {'warm_up': 366, 'duration': 365 * 10,
+                             'data_cache_folder': 'output/data_cache',
+                             'audit_writer_queue': 1000,
+                             'output_folder': 'output/national'}}
+
+    @property
+    def sim_duration(self):
+        """Total run time including warm-up"""
+        return self.warm_up + self.duration
+
+    @property
+    def interarrival_time(self):
+        return 1 / self.arrivals_per_day
+
+    @classmethod
+    def from_dict(cls, settings):
+        """Configuration from dictionary of settings (lists are stored as tuples)"""
+        unknown = set(settings) - set(cls._fields)
+        if unknown:
+            raise ValueError('Unknown configuration settings: %s' % ', '.join(sorted(unknown)))
+        return cls(**{key: tuple(value) if isinstance(value, list) else value
+                      for key, value in settings.items()})
+
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_dict(json.loads(text))
+
+    @classmethod
+    def from_yaml(cls, text):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError('PyYAML is required to read YAML configuration')
+        return cls.from_dict(yaml.safe_load(text) or {})
+
+    @staticmethod
+    def read_settings(filename):
+        """Dictionary of settings from JSON file, or YAML file (.yaml or .yml)"""
+        with open(filename) as f:
+            text = f.read()
+        if filename.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError('PyYAML is required to read YAML configuration')
+            return yaml.safe_load(text) or {}
+        return json.loads(text)
+
+    @classmethod
+    def from_file(cls, filename):
+        """Configuration from JSON file, or YAML file (.yaml or .yml)"""
+        return cls.from_dict(cls.read_settings(filename))
+
+    @staticmethod
+    def parse_setting(override):
+        """(name, value) from 'name=value' (value is read as JSON, otherwise as a string)"""
+        name, _, value = override.partition('=')
+        try:
+            return name, json.loads(value)
+        except ValueError:
+            return name, value
+
+    @classmethod
+    def add_arguments(cls, parser):
+        """Add configuration arguments (--profile, --config, --set) to argument parser"""
+        parser.add_argument('--profile', choices=sorted(cls.profiles),
+                            help='named run profile (applied before --config and --set)')
+        parser.add_argument('--config', help='JSON or YAML configuration file')
+        parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                            help='override configuration setting')
+
+    @classmethod
+    def from_parsed_args(cls, parsed):
+        """Configuration from parsed arguments (see add_arguments): profile settings, then
+        configuration file settings, then --set overrides"""
+        settings = dict(cls.profiles[parsed.profile]) if parsed.profile else {}
+        if parsed.config:
+            settings.update(cls.read_settings(parsed.config))
+        settings.update(cls.parse_setting(override) for override in parsed.set)
+        return cls.from_dict(settings)
+
+    @classmethod
+    def from_args(cls, args=None):
+        """Configuration from command line: optional --profile and --config file, then any
+        number of --set name=value overrides (values are read as JSON, otherwise as strings)"""
+        parser = argparse.ArgumentParser(description='Neonatal demand and capacity model')
+        cls.add_arguments(parser)
+        return cls.from_parsed_args(parser.parse_args(args))
+
+    def to_dict(self):
+        return dict(self._asdict())
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+
+class Clock:
+    """Model day (whole days since start of run) and year (1 = first year)"""
+
+    def __init__(self):
+        self.day = 0
+        self.year = 1
+
+    def next_day(self):
+        """Advance one day. Returns True if a new year has started."""
+        self.day += 1
+        new_year = int(self.day / 365) + 1
+        new_year_started = new_year != self.year
+        self.year = new_year
+        return new_year_started
@@ -11,22 +11,30 @@ https://www.apache.org/licenses/LICENSE-2.0
 For info contact michael.allen1966@gmail.com
 """
 
+import hashlib
+import os
+import pickle
+
 import numpy as np
 import pandas as pd
 import time
 
 
 class Data:
-    def __init__(self, truncate):
+    # Increase when loaded data attributes change (invalidates cached data, see load)
+    cache_version = 1
+
+    def __init__(self, truncate, data_folder='data'):
         start = time.time()
         self.truncate = truncate
+        self.data_folder = data_folder
         self.load_data()
         self.filter_input_data_to_only_used_neonatal_units()
-        self.travel_tuples = self.create_travel_distance_tuple_array(self.time_df)
-        self.interhospital_distance_tuples = self.create_travel_distance_tuple_array(
+        self.hospital_index = {hospital: index for index, hospital in enumerate(self.hospitals)}
+        self.create_travel_time_array(self.time_df)
+        self.interhospital_distance = self.create_hospital_pair_array(
             self.interhospital_distance_df)
-        self.interhospital_time_tuples = self.create_travel_distance_tuple_array(
-            self.interhospital_time_df)
+        self.interhospital_time = self.create_hospital_pair_array(self.interhospital_time_df)
         self.find_order_of_hospitals_by_closeness()
         self.order_with_home_network_first()
         self.set_up_transition_probability_matrix()
@@ -39,23 +47,59 @@ class Data:
         end = time.time()
         print('\nData loaded and munged in %d seconds' % (end - start))
 
+    @classmethod
+    def load(cls, truncate, data_folder='data', cache_folder=None):
+        """
+        Load data, using a pickled copy of previously loaded and munged data from cache_folder
+        where available (otherwise loading from data_folder and saving to cache_folder). The
+        cache file is named by a hash of cache_version, the source of this module, truncate and
+        the name, size and modification time of each file in data_folder, so data is loaded
+        afresh when input data or data loading code change.
+        """
+        if cache_folder is None:
+            return cls(truncate, data_folder)
 
-    def create_travel_distance_tuple_array(self, matrix):
-        print('Creating travel time table...')
-        index_tuple_list = []
-        distance_list = []
+        key = hashlib.sha1(repr((cls.cache_version, os.path.abspath(data_folder),
+                                 bool(truncate))).encode())
+        with open(__file__, 'rb') as f:
+            key.update(f.read())
+        for name in sorted(os.listdir(data_folder)):
+            stat = os.stat(os.path.join(data_folder, name))
+            key.update(repr((name, stat.st_size, stat.st_mtime_ns)).encode())
+        filename = os.path.join(cache_folder, 'data_%s.pkl' % key.hexdigest())
 
-        for row_index, row in matrix.iterrows():  # iteraate through rows
-            for column_index, data in row.iteritems():  # iterate through 'columns' (items in selected row)
-                index_tuple = (row_index, column_index)  # create index tuple
-                index_tuple_list.append(index_tuple)  # add index tuple to list
-                distance_list.append(data)  # add distance data to list
+        if os.path.exists(filename):
+            start = time.time()
+            with open(filename, 'rb') as f:
+                data = pickle.load(f)
+            print('\nData loaded from cache %s in %.1f seconds' % (filename, time.time() - start))
+            return data
+
+        data = cls(truncate, data_folder)
+        if not os.path.exists(cache_folder):
+            os.makedirs(cache_folder, exist_ok=True)
+        # Write to temporary file then rename, so parallel runs never read a partial file
+        temporary_filename = '%s.%d' % (filename, os.getpid())
+        with open(temporary_filename, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_filename, filename)
+        return data
+
+    def create_travel_time_array(self, matrix):
+        """
+        LSOA x hospital travel times (minutes) as a dense float32 2D array, with LSOAs
+        addressed by integer index from self.lsoa_index and hospitals from self.hospital_index.
+        """
+        print('Creating travel time table...')
+        self.lsoa_index = {lsoa: index for index, lsoa in enumerate(matrix.index)}
+        self.travel_times = matrix[self.hospitals].values.astype(np.float32)
 
-        multi_index = pd.MultiIndex.from_tuples(index_tuple_list,
-                                                names=['from',
-                                                       'to'])  # set up a tuple multi-level index
-        output = pd.Series(distance_list, index=multi_index, name='Distance')
-        return output
+    def create_hospital_pair_array(self, matrix):
+        """
+        Returns hospital x hospital matrix as a dense 2D array, ordered as self.hospitals.
+        Hospitals are addressed by integer index from self.hospital_index.
+        """
+        return matrix.loc[self.hospitals, self.hospitals].values.astype(np.float64)
 
     def filter_input_data_to_only_used_neonatal_units(self):
         print('\nTruncated to listed neonatal units...')
@@ -69,45 +113,86 @@ class Data:
     def load_data(self):
         # Load data with munging
         print('\nLoading data...')
-        self.deliveries = pd.read_csv('data/deliveries.csv')
-        self.fetuses_table = pd.read_csv('data/fetuses.csv')
-        self.entry_point = pd.read_csv('data/entry_point.csv')
-        self.exit_surgery = pd.read_csv('data/exit_surgery.csv')
-        self.exit_level_1 = pd.read_csv('data/exit_level_1.csv')
-        self.exit_level_2 = pd.read_csv('data/exit_level_2.csv')
-        self.exit_level_3 = pd.read_csv('data/exit_level_3.csv')
-        self.exit_level_4 = pd.read_csv('data/exit_level_4.csv')
-        self.los_ln_mu = pd.read_csv('data/los_ln_mu.csv')
-        self.los_ln_stdev = pd.read_csv('data/los_ln_stdev.csv')
+        self.deliveries = pd.read_csv(self.data_folder + '/deliveries.csv')
+        self.fetuses_table = pd.read_csv(self.data_folder + '/fetuses.csv')
+        self.entry_point = pd.read_csv(self.data_folder + '/entry_point.csv')
+        self.exit_surgery = pd.read_csv(self.data_folder + '/exit_surgery.csv')
+        self.exit_level_1 = pd.read_csv(self.data_folder + '/exit_level_1.csv')
+        self.exit_level_2 = pd.read_csv(self.data_folder + '/exit_level_2.csv')
+        self.exit_level_3 = pd.read_csv(self.data_folder + '/exit_level_3.csv')
+        self.exit_level_4 = pd.read_csv(self.data_folder + '/exit_level_4.csv')
+        self.los_ln_mu = pd.read_csv(self.data_folder + '/los_ln_mu.csv')
+        self.los_ln_stdev = pd.read_csv(self.data_folder + '/los_ln_stdev.csv')
         self.los_ln_mu.set_index('Category', inplace=True)
         self.los_ln_stdev.set_index('Category', inplace=True)
-        self.time_df = pd.read_csv('data/travel_matrix_minutes.csv', low_memory=False)
-        self.time_df.set_index('LSOA', inplace=True)
-        self.time_df = self.time_df.apply(pd.to_numeric, errors='coerce')
+        self.hospital_info_df = pd.read_csv(self.data_folder + '/hospital_info.csv')
+        print('Loaded hospital info size: ', self.hospital_info_df.shape)
+        self.time_df = self.load_travel_matrix(self.data_folder + '/travel_matrix_minutes.csv')
 
-        self.interhospital_distance_df = pd.read_csv('data/inter_hospital_d.csv')
+        self.interhospital_distance_df = pd.read_csv(self.data_folder + '/inter_hospital_d.csv')
         self.interhospital_distance_df.set_index('Hospital', inplace=True)
         self.interhospital_distance_df = self.interhospital_distance_df.apply(pd.to_numeric,
                                                                               errors='coerce')
 
-        self.interhospital_time_df = pd.read_csv('data/inter_hospital_t.csv')
+        self.interhospital_time_df = pd.read_csv(self.data_folder + '/inter_hospital_t.csv')
         self.interhospital_time_df.set_index('Hospital', inplace=True)
         self.interhospital_time_df = self.interhospital_time_df.apply(pd.to_numeric,
                                                                       errors='coerce')
 
         print('Loaded distance matrix size: ', self.time_df.shape)
-        self.hospital_info_df = pd.read_csv('data/hospital_info.csv')
-        print('Loaded hospital info size: ', self.hospital_info_df.shape)
-        self.lsoa_demand = pd.read_csv('data/predicted_neonatal_demand_by_lsoa.csv')
+        self.lsoa_demand = pd.read_csv(
+            self.data_folder + '/predicted_neonatal_demand_by_lsoa.csv')
         self.lsoa_demand.set_index('LSOA', inplace=True)
         print('Loaded LSOA demand size: ', self.lsoa_demand.shape)
         self.hospitals = list(self.hospital_info_df['hospital_postcode'])
 
-        # Shorten for testing code
+        # Shorten for testing code (travel matrix is truncated as it is read)
         if self.truncate:
-            self.time_df = self.time_df.head(1000)
             self.lsoa_demand = self.lsoa_demand.head(1000)
 
+        # LSOA demand weights for selection of patient LSOA (cumulative weights are used with
+        # common random numbers). Not changed by models (see Model.set_lsoa_weights).
+        self.lsoa_weights = self.lsoa_demand['all_neonatal']
+        self.lsoa_cumulative_weights = np.cumsum(self.lsoa_weights.values)
+
+    def load_travel_matrix(self, filename):
+        """
+        Reads the LSOA x hospital travel time matrix. Only the LSOA column and columns for
+        hospitals with a current neonatal unit are read, and times are parsed directly to
+        float32. If any cell cannot be parsed as a number the matrix is re-read as text and
+        coerced (as pandas to_numeric with errors='coerce'), and the unparseable cells are
+        reported. Cells that cannot be parsed are set to NaN.
+        """
+        used_hospitals = list(self.hospital_info_df.loc[
+            self.hospital_info_df['neonatal_current'] == 1, 'hospital_postcode'])
+        # Only request columns present in file (missing hospitals fail on later filtering)
+        file_columns = set(pd.read_csv(filename, nrows=0).columns)
+        columns = [hospital for hospital in used_hospitals if hospital in file_columns]
+        nrows = 1000 if self.truncate else None
+
+        try:
+            time_df = pd.read_csv(filename, usecols=['LSOA'] + columns, index_col='LSOA',
+                                  dtype={hospital: np.float32 for hospital in columns},
+                                  nrows=nrows)
+            bad_cells = 0
+        except ValueError:
+            # Non-numeric entries present: read as text and coerce column by column
+            print('Non-numeric travel times found; coercing...')
+            text_df = pd.read_csv(filename, usecols=['LSOA'] + columns, index_col='LSOA',
+                                  dtype=str, nrows=nrows)
+            time_df = text_df.apply(pd.to_numeric, errors='coerce').astype(np.float32)
+            bad = time_df.isnull().values & text_df.notnull().values
+            bad_cells = bad.sum()
+            # Report first 10 bad cells
+            for row, col in list(zip(*np.nonzero(bad)))[:10]:
+                print('  Bad travel time: LSOA %s, hospital %s, value %r' %
+                      (text_df.index[row], text_df.columns[col], text_df.iat[row, col]))
+            del text_df
+
+        print('Travel matrix cells not parsed as numbers (set to NaN): %d' % bad_cells)
+        print('Travel matrix missing cells: %d' % time_df.isnull().values.sum())
+        return time_df
+
     def find_order_of_hospitals_by_closeness(self):
         print('\nRanking hospitals by closeness to each LSOA...')
         closest_hospital_order_list = []
@@ -180,11 +265,11 @@ class Data:
 
         self.transition_matrix = np.zeros((5, 7, 6))
 
-        self.exit_surgery = pd.read_csv('data/exit_surgery.csv')
-        self.exit_level_1 = pd.read_csv('data/exit_level_1.csv')
-        self.exit_level_2 = pd.read_csv('data/exit_level_2.csv')
-        self.exit_level_3 = pd.read_csv('data/exit_level_3.csv')
-        self.exit_level_4 = pd.read_csv('data/exit_level_4.csv')
+        self.exit_surgery = pd.read_csv(self.data_folder + '/exit_surgery.csv')
+        self.exit_level_1 = pd.read_csv(self.data_folder + '/exit_level_1.csv')
+        self.exit_level_2 = pd.read_csv(self.data_folder + '/exit_level_2.csv')
+        self.exit_level_3 = pd.read_csv(self.data_folder + '/exit_level_3.csv')
+        self.exit_level_4 = pd.read_csv(self.data_folder + '/exit_level_4.csv')
 
         # Set index column, so that all remaining data is numerical
         self.exit_surgery.set_index('Category', inplace=True)
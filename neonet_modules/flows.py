@@ -0,0 +1,96 @@
+"""National neonatal demand and capacity model
+*** Requires Python 3.6 or greater***
+
+Class to record origin-destination flows
+
+Version 170601
+
+(c)2017 Michael Allen
+This code is distributed under GNU GPL2
+https://www.gnu.org/licenses/old-licenses/gpl-2.0.en.html
+For info contact michael.allen1966@gmail.com
+"""
+
+import os
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+
+class Flows:
+    """
+    Origin-destination counts, updated incrementally during the run (after warm up):
+    1. LSOA -> hospital admissions (each spell placed in a hospital)
+    2. Hospital -> hospital transfers
+    Both are counted by care level (0 = surgery --> 4 = TC) and model year.
+
+    Counts are held as dictionaries keyed by (care level, year, origin, destination), so only
+    non-zero pairs use memory. On save each (care level, year) is written as a scipy sparse
+    matrix (.npz, requires scipy) with origins as rows and destinations as columns. Row and
+    column labels are saved as lsoa_index.csv and hospital_index.csv.
+    """
+
+    def __init__(self, lsoas, hospitals):
+        self.lsoas = lsoas
+        self.hospitals = hospitals
+        self.lsoa_index = {lsoa: index for index, lsoa in enumerate(lsoas)}
+        self.hospital_index = {hospital: index for index, hospital in enumerate(hospitals)}
+        self.admissions = defaultdict(int)
+        self.transfers = defaultdict(int)
+
+    def record_admission(self, lsoa, hospital, care_level, year):
+        self.admissions[(care_level, year, self.lsoa_index[lsoa],
+                         self.hospital_index[hospital])] += 1
+
+    def record_transfer(self, from_hospital, to_hospital, care_level, year):
+        self.transfers[(care_level, year, self.hospital_index[from_hospital],
+                        self.hospital_index[to_hospital])] += 1
+
+    def transfer_totals(self):
+        """Hospital -> hospital transfers of all care levels and years, as a dense array
+        indexed as hospitals"""
+        totals = np.zeros((len(self.hospitals), len(self.hospitals)), dtype=np.int64)
+        for (_, _, origin, destination), count in self.transfers.items():
+            totals[origin, destination] += count
+        return totals
+
+    @staticmethod
+    def to_sparse_matrices(counts, shape):
+        """Convert counts dictionary to dictionary of (care level, year) -> sparse matrix"""
+        import scipy.sparse
+        grouped = defaultdict(lambda: ([], [], []))
+        for (care_level, year, origin, destination), count in counts.items():
+            rows, cols, values = grouped[(care_level, year)]
+            rows.append(origin)
+            cols.append(destination)
+            values.append(count)
+        matrices = {}
+        for key, (rows, cols, values) in grouped.items():
+            matrices[key] = scipy.sparse.coo_matrix((values, (rows, cols)), shape=shape).tocsr()
+        return matrices
+
+    def admission_matrices(self):
+        return self.to_sparse_matrices(self.admissions, (len(self.lsoas), len(self.hospitals)))
+
+    def transfer_matrices(self):
+        return self.to_sparse_matrices(self.transfers,
+                                       (len(self.hospitals), len(self.hospitals)))
+
+    def save(self, output_folder):
+        # scipy is imported here so it is needed only to save flows
+        import scipy.sparse
+        folder = output_folder + '/flows'
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        pd.Series(self.lsoas, name='lsoa').to_csv(folder + '/lsoa_index.csv',
+                                                  index_label='index')
+        pd.Series(self.hospitals, name='hospital').to_csv(folder + '/hospital_index.csv',
+                                                          index_label='index')
+
+        for name, matrices in [('admissions', self.admission_matrices()),
+                               ('transfers', self.transfer_matrices())]:
+            for (care_level, year), matrix in matrices.items():
+                filename = '%s/%s_level_%d_year_%d.npz' % (folder, name, care_level, year)
+                scipy.sparse.save_npz(filename, matrix)
@@ -0,0 +1,148 @@
+"""National neonatal demand and capacity model
+*** Requires Python 3.6 or greater***
+
+Class to monitor memory use of a model run
+
+Version 170601
+
+(c)2017 Michael Allen
+This code is distributed under GNU GPL2
+https://www.gnu.org/licenses/old-licenses/gpl-2.0.en.html
+For info contact michael.allen1966@gmail.com
+"""
+
+import gc
+import os
+import time
+import tracemalloc
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def resident_memory():
+    """Current resident set size (MB). Uses /proc where available, otherwise the process
+    peak resident set size."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return peak_resident_memory()
+
+
+def peak_resident_memory():
+    """Peak resident set size of process so far (MB), NaN if not available"""
+    if resource is None:
+        return np.nan
+    # ru_maxrss is in kB on Linux (bytes on macOS)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class MemoryMonitor:
+    """Opt-in memory instrumentation (Config memory_interval) by phase and simulated interval"""
+
+    def __init__(self, top=25, frames=1):
+        self.top = top
+        self.phases = []
+        self.samples = []
+        self.object_counts = []
+        self.allocations = []
+        self.phase = None
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start(frames)
+
+    def start_phase(self, name):
+        """End current phase (if any) and start a new phase"""
+        self.end_phase()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        rss = resident_memory()
+        self.phase = {'phase': name, 'start_time': time.time(), 'start_rss_mb': rss,
+                      'max_sampled_rss_mb': rss}
+
+    def end_phase(self):
+        if self.phase is None:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        rss = resident_memory()
+        self.phase['seconds'] = time.time() - self.phase.pop('start_time')
+        self.phase['end_rss_mb'] = rss
+        self.phase['max_sampled_rss_mb'] = max(self.phase['max_sampled_rss_mb'], rss)
+        self.phase['process_peak_rss_mb'] = peak_resident_memory()
+        self.phase['traced_current_mb'] = current / 2 ** 20
+        self.phase['traced_peak_mb'] = peak / 2 ** 20
+        self.phases.append(self.phase)
+        self.phase = None
+
+    def sample(self, day, model):
+        current, peak = tracemalloc.get_traced_memory()
+        rss = resident_memory()
+        if self.phase is not None:
+            self.phase['max_sampled_rss_mb'] = max(self.phase['max_sampled_rss_mb'], rss)
+        self.samples.append({
+            'day': day,
+            'phase': self.phase['phase'] if self.phase is not None else '',
+            'rss_mb': rss,
+            'traced_current_mb': current / 2 ** 20,
+            'traced_peak_mb': peak / 2 ** 20,
+            'patients': len(model.network.patients),
+            'displaced_patient_ids': len(model.network.displaced_patients_ids),
+            'event_queue': len(model.env._queue),
+            'admission_queue_entries': sum(len(queue) for queue in
+                                           model.network.admission_queues.values())})
+
+        counts = Counter(type(obj).__name__ for obj in gc.get_objects())
+        for type_name, count in counts.most_common(self.top):
+            self.object_counts.append({'day': day, 'type': type_name, 'count': count})
+
+        statistics = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__)]).statistics('lineno')
+        for rank, statistic in enumerate(statistics[:self.top]):
+            frame = statistic.traceback[0]
+            self.allocations.append({'day': day, 'rank': rank + 1,
+                                     'location': '%s:%d' % (frame.filename, frame.lineno),
+                                     'size_kb': statistic.size / 1024,
+                                     'blocks': statistic.count})
+
+    def growth(self):
+        """Change in object counts and allocation site sizes from first to last sample"""
+        growth = []
+        for table, key, value in [(self.object_counts, 'type', 'count'),
+                                  (self.allocations, 'location', 'size_kb')]:
+            df = pd.DataFrame(table)
+            if df.empty:
+                continue
+            first = df.loc[df['day'] == df['day'].min()].set_index(key)[value]
+            last = df.loc[df['day'] == df['day'].max()].set_index(key)[value]
+            change = last.sub(first, fill_value=0).sort_values(ascending=False)
+            for item, difference in change.head(self.top).items():
+                growth.append({'measure': value, 'item': item, 'first': first.get(item, 0),
+                               'last': last.get(item, 0), 'growth': difference})
+        return pd.DataFrame(growth, columns=['measure', 'item', 'first', 'last', 'growth'])
+
+    def report(self):
+        """End monitoring and return memory tables by name"""
+        self.end_phase()
+        if self.started_tracing:
+            tracemalloc.stop()
+        phases = pd.DataFrame(self.phases)
+        growth = self.growth()
+        report = {'memory_phases': phases,
+                  'memory_samples': pd.DataFrame(self.samples),
+                  'memory_object_counts': pd.DataFrame(self.object_counts),
+                  'memory_allocations': pd.DataFrame(self.allocations),
+                  'memory_growth': growth}
+
+        print('\nMemory by phase (MB):')
+        print(phases.set_index('phase')[['end_rss_mb', 'max_sampled_rss_mb',
+                                         'process_peak_rss_mb', 'traced_peak_mb']].to_string())
+        print('\nGreatest memory growth:')
+        print(growth.head(10).to_string(index=False))
+        return report
@@ -34,3 +34,7 @@ class Network:
         self.patients = {}
         self.displaced_patients_ids = []
         self.deliveries = 0
+        # Admission queues keyed by (hospital, unit type); heaps of queue entries
+        self.admission_queues = {}
+        self.queue_sequence = 0
+        self.queued = 0
@@ -0,0 +1,160 @@
+"""National neonatal demand and capacity model
+*** Requires Python 3.6 or greater***
+
+Class to search for nurse capacity of each unit
+
+Version 170601
+
+(c)2017 Michael Allen
+This code is distributed under GNU GPL2
+https://www.gnu.org/licenses/old-licenses/gpl-2.0.en.html
+For info contact michael.allen1966@gmail.com
+"""
+
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+
+# Model run to end of warm up, shared with evaluation processes (which are forked from the
+# optimising process and so start from a copy of the warmed up model)
+_warm_model = None
+
+
+def _evaluate(candidate, nurse_capacity, output_folder, workload_percentile):
+    """Run warmed up model with candidate capacities (in forked process) and return results.
+    Audits are kept in memory unless an output folder is given."""
+    _warm_model.set_capacities(nurse_capacity)
+    _warm_model.run_from_warm_up(output_folder)
+
+    hospital_audit = _warm_model.audit.read_table('hospital_day_audit')
+    workload = hospital_audit.groupby('hospital')['current_workload'].quantile(
+        workload_percentile / 100)
+    general_audit = _warm_model.audit.read_table('general_day_audit')
+
+    return {'candidate': candidate,
+            'workload': workload,
+            'displaced': general_audit['displaced'].mean(),
+            'episodes_no_bed': _warm_model.audit.episodes_with_no_bed_found}
+
+
+class CapacityOptimiser:
+    """Greedy marginal allocation of nurse capacity to units, with candidate allocations evaluated
+    in parallel from the warm model"""
+
+    def __init__(self, model, output_folder, displaced_target=1.0, workload_percentile=90,
+                 step=1, candidates_per_round=8, workers=None, max_rounds=200,
+                 initial_fraction=0.8, keep_outputs=False):
+        self.model = model
+        self.output_folder = output_folder
+        self.displaced_target = displaced_target
+        self.workload_percentile = workload_percentile
+        self.step = step
+        self.candidates_per_round = candidates_per_round
+        self.workers = workers if workers else multiprocessing.cpu_count()
+        self.max_rounds = max_rounds
+        self.initial_fraction = initial_fraction
+        self.keep_outputs = keep_outputs
+        self.evaluations = []
+        self.candidate_count = 0
+
+    def evaluate(self, capacities_list):
+        """Evaluate list of capacities (Series by hospital) in parallel. Returns results."""
+        global _warm_model
+        _warm_model = self.model
+
+        tasks = []
+        for nurse_capacity in capacities_list:
+            folder = None
+            if self.keep_outputs:
+                folder = '%s/candidate_%05d' % (self.output_folder, self.candidate_count)
+            tasks.append((self.candidate_count, nurse_capacity, folder,
+                          self.workload_percentile))
+            self.candidate_count += 1
+
+        # Each evaluation is in a fresh fork of this process (at end of warm up)
+        context = multiprocessing.get_context('fork')
+        with context.Pool(processes=self.workers, maxtasksperchild=1) as pool:
+            results = pool.starmap(_evaluate, tasks)
+
+        for result, task in zip(results, tasks):
+            nurse_capacity = task[1]
+            result['nurse_capacity'] = nurse_capacity
+            result['total_nurses'] = nurse_capacity.sum()
+            result['excess_workload'] = (result['workload'] -
+                                         nurse_capacity).clip(lower=0).sum()
+            result['objective'] = result['displaced'] + result['excess_workload']
+            self.evaluations.append(result)
+        return results
+
+    def targets_met(self, result):
+        return (result['excess_workload'] == 0 and
+                result['displaced'] <= self.displaced_target)
+
+    def select_units(self, result):
+        """Units to try adding nurses to"""
+        nurse_capacity = result['nurse_capacity']
+        excess = result['workload'] - nurse_capacity
+        if (excess > 0).any():
+            order = excess[excess > 0].sort_values(ascending=False)
+        else:
+            order = (result['workload'] / nurse_capacity.clip(lower=1)).sort_values(
+                ascending=False)
+        return list(order.index[:self.candidates_per_round])
+
+    def pareto_front(self):
+        """Evaluations not dominated in both total nurses and displaced infants"""
+        evaluations = pd.DataFrame([{'candidate': result['candidate'],
+                                     'total_nurses': result['total_nurses'],
+                                     'displaced': result['displaced'],
+                                     'episodes_no_bed': result['episodes_no_bed'],
+                                     'excess_workload': result['excess_workload']}
+                                    for result in self.evaluations])
+        evaluations.sort_values(['total_nurses', 'displaced'], inplace=True)
+        best_displaced = np.inf
+        on_front = []
+        for displaced in evaluations['displaced']:
+            on_front.append(displaced < best_displaced)
+            best_displaced = min(best_displaced, displaced)
+        return evaluations, evaluations.loc[on_front]
+
+    def save(self, best):
+        evaluations, pareto_front = self.pareto_front()
+        evaluations.to_csv(self.output_folder + '/optimisation_evaluations.csv', index=False)
+        pareto_front.to_csv(self.output_folder + '/pareto_front.csv', index=False)
+        best['nurse_capacity'].rename('nurse_capacity').to_csv(
+            self.output_folder + '/optimised_nurse_capacity.csv', index_label='hospital')
+
+    def run(self, initial_capacities=None):
+        if not os.path.exists(self.output_folder):
+            os.makedirs(self.output_folder)
+
+        if initial_capacities is None:
+            current_capacities = self.model.network.status['nursing_capacity'].copy()
+            unconstrained = self.evaluate([current_capacities])[0]
+            initial_capacities = np.floor(
+                unconstrained['workload'] * self.initial_fraction).clip(lower=1)
+            initial_capacities = initial_capacities.loc[current_capacities.index].rename(
+                'nursing_capacity')
+
+        best = self.evaluate([initial_capacities])[0]
+        rounds = 0
+        while not self.targets_met(best) and rounds < self.max_rounds:
+            rounds += 1
+            candidates = []
+            for hospital in self.select_units(best):
+                nurse_capacity = best['nurse_capacity'].copy()
+                nurse_capacity[hospital] += self.step
+                candidates.append(nurse_capacity)
+            results = self.evaluate(candidates)
+            # Accept best candidate (a step is always taken, as every candidate adds nurses)
+            best = min(results, key=lambda result: result['objective'])
+            print('Round %d: total nurses %d, displaced %.2f, excess workload %.2f' %
+                  (rounds, best['total_nurses'], best['displaced'], best['excess_workload']))
+            self.save(best)
+
+        self.save(best)
+        print('Optimisation %s after %d rounds' % (
+            'targets met' if self.targets_met(best) else 'stopped', rounds))
+        return best['nurse_capacity']
@@ -0,0 +1,414 @@
+"""National neonatal demand and capacity model
+*** Requires Python 3.6 or greater***
+
+Classes to run the model partitioned by operational network
+
+Version 170601
+
+(c)2017 Michael Allen
+This code is distributed under GNU GPL2
+https://www.gnu.org/licenses/old-licenses/gpl-2.0.en.html
+For info contact michael.allen1966@gmail.com
+"""
+
+import multiprocessing
+import multiprocessing.connection
+import random
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from neonet import Model
+from neonet_modules.audit import Audit
+from neonet_modules.config import Clock
+from neonet_modules.data import Data
+from neonet_modules.flows import Flows
+from neonet_modules.results import Results
+from neonet_modules.summarise import Summarise
+
+# Data loaded once by the coordinating process, shared with network processes (which are
+# forked from the coordinating process)
+_data = None
+
+
+class NetworkModel(Model):
+    """Model of one operational network, seeing other networks' hospitals through daily
+    occupancy snapshots"""
+
+    occupancy_columns = ['current_workload'] + Model.network_count_columns + ['all_infants']
+
+    def __init__(self, config, data, network_name, connection):
+        super().__init__(config, data)
+        self.network_name = network_name
+        self.connection = connection
+        self.lsoa_networks = lsoa_home_networks(data)
+        self.exports = []
+        self.releases = []
+        self.spell_end_times = {}
+        self.imported_spells = {}
+
+    def set_up_run(self):
+        super().set_up_run()
+        hospital_networks = self.data.network_lookup['network']
+        self.own_hospitals = set(hospital_networks.index[hospital_networks == self.network_name])
+        self.own_positions = [self.data.hospital_index[hospital]
+                              for hospital in self.data.hospitals
+                              if hospital in self.own_hospitals]
+        self.remote_positions = [self.data.hospital_index[hospital]
+                                 for hospital in self.data.hospitals
+                                 if hospital not in self.own_hospitals]
+        self.column_positions = [self.network.status.columns.get_loc(column)
+                                 for column in self.occupancy_columns]
+        self.env.process(self.sync_process())
+
+    def set_lsoa_weights(self, weights):
+        """Set LSOA demand weights, removing demand from LSOAs with home network elsewhere"""
+        super().set_lsoa_weights(weights.where(self.lsoa_networks == self.network_name, 0))
+
+    def admit_patient(self, p, hospital, _required_nurse_resources):
+        super().admit_patient(p, hospital, _required_nurse_resources)
+        # Expected end of spell (later than actual end if admitted from queue)
+        self.spell_end_times[p.id] = self.env.now + p.los[p.required_care_level_current]
+        if hospital not in self.own_hospitals:
+            self.export_spell(p, hospital)
+
+    def relocate_patient(self, p, hospital, _required_nurse_resources):
+        old_hospital = p.current_hospital
+        super().relocate_patient(p, hospital, _required_nurse_resources)
+        if old_hospital not in self.own_hospitals:
+            self.release_spell(p, old_hospital)
+        if hospital not in self.own_hospitals:
+            self.export_spell(p, hospital)
+
+    def end_spell(self, p):
+        super().end_spell(p)
+        if (p.current_hospital not in self.own_hospitals and
+                self.env.now < self.spell_end_times[p.id] - 1e-9):
+            self.release_spell(p, p.current_hospital)
+        del self.spell_end_times[p.id]
+
+    def spell_key(self, p, hospital):
+        return self.network_name, p.id, p.spells, hospital
+
+    def export_spell(self, p, hospital):
+        care_level = p.required_care_level_current
+        self.exports.append((hospital, care_level, self.config.nurse_for_care_level[care_level],
+                             self.spell_end_times[p.id], self.spell_key(p, hospital)))
+
+    def release_spell(self, p, hospital):
+        care_level = p.required_care_level_current
+        self.releases.append((hospital, care_level, self.config.nurse_for_care_level[care_level],
+                              self.spell_key(p, hospital)))
+
+    def change_occupancy(self, hospital, care_level, nurse_resources, infants):
+        status = self.network.status
+        status.set_value(hospital, 'current_workload',
+                         status.loc[hospital]['current_workload'] + infants * nurse_resources)
+        network_col = self.network_count_columns[care_level]
+        status.set_value(hospital, network_col, status.loc[hospital][network_col] + infants)
+        status.set_value(hospital, 'all_infants', status.loc[hospital]['all_infants'] + infants)
+
+    def imported_spell_process(self, hospital, care_level, nurse_resources, end_time, key):
+        """Occupy capacity until expected end of spell, or until released"""
+        self.change_occupancy(hospital, care_level, nurse_resources, 1)
+        yield self.env.timeout(max(end_time - self.env.now, 0)) | self.imported_spells[key]
+        del self.imported_spells[key]
+        self.change_occupancy(hospital, care_level, nurse_resources, -1)
+
+    def sync_process(self):
+        while True:
+            yield self.env.timeout(1)
+            status = self.network.status
+            own_occupancy = status.iloc[self.own_positions, self.column_positions].values
+            self.connection.send(('sync', own_occupancy, self.exports, self.releases))
+            occupancy, imports, releases = self.connection.recv()
+
+            # Other networks' hospitals: latest snapshot, plus spells just exported and
+            # released (which are not yet in the snapshot)
+            for column, position in zip(self.occupancy_columns, self.column_positions):
+                status.iloc[self.remote_positions, position] = (
+                    occupancy[self.remote_positions, self.occupancy_columns.index(column)]
+                    .astype(status[column].dtype))
+            for hospital, care_level, nurse_resources, _, _ in self.exports:
+                self.change_occupancy(hospital, care_level, nurse_resources, 1)
+            for hospital, care_level, nurse_resources, _ in self.releases:
+                self.change_occupancy(hospital, care_level, nurse_resources, -1)
+            self.exports = []
+            self.releases = []
+
+            for hospital, care_level, nurse_resources, end_time, key in imports:
+                self.imported_spells[key] = self.env.event()
+                self.env.process(self.imported_spell_process(
+                    hospital, care_level, nurse_resources, end_time, key))
+            # Released spells end now (unless already ended)
+            for _, _, _, key in releases:
+                release = self.imported_spells.get(key)
+                if release is not None and not release.triggered:
+                    release.succeed()
+
+    def results(self):
+        """Audit tables (own hospitals only for hospital audit) and totals for combining"""
+        logs = self.audit.logs()
+        hospital_audit = logs['hospital_day_audit']
+        logs['hospital_day_audit'] = hospital_audit.loc[
+            hospital_audit['hospital'].isin(self.own_hospitals)]
+        totals = {name: getattr(self.audit, name) for name in PartitionedRun.audit_totals}
+        return {'logs': logs,
+                'totals': totals,
+                'distance_from_home_counts': self.audit.distance_from_home_counts,
+                'travel_time_counts': self.audit.travel_time_counts,
+                'multiple_birth_counts': self.audit.multiple_birth_counts,
+                'admissions': dict(self.flows.admissions),
+                'transfers': dict(self.flows.transfers)}
+
+
+def lsoa_home_networks(data):
+    """Network of closest hospital to each LSOA (indexed as LSOA demand)"""
+    closest_hospital = data.ordered_hospital_by_network[0]
+    networks = data.network_lookup['network'].reindex(closest_hospital.values)
+    return pd.Series(networks.values, index=closest_hospital.index).reindex(
+        data.lsoa_demand.index)
+
+
+def _run_network(connection, config, network_name, seed, report_progress):
+    """Run model of one network (in forked process), synchronising with coordinator"""
+    random.seed(seed)
+    np.random.seed(seed)
+    model = NetworkModel(config, _data, network_name, connection)
+    model.set_up_run()
+    model.progress.print_output = report_progress
+    model.env.run(until=config.sim_duration)
+    model.progress.close(model.clock.day, model.network, model.audit)
+    connection.send(('done', model.results()))
+    connection.close()
+
+
+def _run_monolithic(connection, config, seed):
+    """Run national model (in forked process) for comparison"""
+    random.seed(seed)
+    np.random.seed(seed)
+    model = Model(config, _data)
+    connection.send(model.run().tables)
+    connection.close()
+
+
+class PartitionedRun:
+    """Runs each operational network as a NetworkModel in its own process, synchronised daily,
+    and combines their results as for a national run"""
+
+    audit_totals = ['transfers', 'total_transfer_distance', 'total_transfer_time',
+                    'episodes_with_no_bed_found', 'total_episodes_length_with_no_bed_found',
+                    'admissions_from_queue', 'total_queue_wait']
+
+    def __init__(self, config, data=None, seed=1):
+        self.config = config
+        self.data = data
+        self.seed = seed
+        self.error = None
+
+    def network_configs(self):
+        """Configuration of each network: arrivals scaled by network share of demand"""
+        lsoa_networks = lsoa_home_networks(self.data)
+        weights = self.data.lsoa_weights
+        configs = {}
+        for number, network_name in enumerate(self.networks):
+            share = weights[lsoa_networks == network_name].sum() / weights.sum()
+            crn_seed = self.config.crn_seed
+            if crn_seed is not None:
+                crn_seed = (crn_seed, number)
+            configs[network_name] = self.config._replace(
+                arrivals_per_day=self.config.arrivals_per_day * share, crn_seed=crn_seed,
+                write_output=False, keep_logs=True)
+        return configs
+
+    def run(self, compare=False):
+        global _data
+        if self.data is None:
+            self.data = Data.load(self.config.truncate_data, self.config.data_folder,
+                                  cache_folder=self.config.data_cache_folder)
+        _data = self.data
+        self.networks = sorted(self.data.network_lookup['network'].unique())
+        configs = self.network_configs()
+
+        context = multiprocessing.get_context('fork')
+        connections = []
+        processes = []
+        for number, network_name in enumerate(self.networks):
+            connection, child_connection = context.Pipe()
+            # Progress is printed by first network only
+            process = context.Process(target=_run_network, args=(
+                child_connection, configs[network_name], network_name, self.seed + number,
+                number == 0))
+            process.start()
+            # Close parent's copy of child end, so a failed process gives end of file
+            child_connection.close()
+            connections.append(connection)
+            processes.append(process)
+
+        if compare:
+            monolithic_connection, child_connection = context.Pipe()
+            monolithic_process = context.Process(target=_run_monolithic, args=(
+                child_connection, self.config._replace(write_output=False), self.seed))
+            monolithic_process.start()
+            child_connection.close()
+            processes.append(monolithic_process)
+
+        try:
+            network_results = self.coordinate(connections, processes)
+            if compare:
+                monolithic_tables = self.receive(
+                    [monolithic_connection], [monolithic_process], ['monolithic'])[0]
+        finally:
+            # Stop any remaining processes (if a process failed)
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+        results = self.combine(network_results)
+
+        if compare:
+            self.error = self.compare_results(results.tables, monolithic_tables)
+            print('\nPartitioned vs monolithic run:')
+            print(self.error)
+            if self.config.write_output:
+                self.error.to_csv(self.config.output_folder + '/partition_error.csv')
+        return results
+
+    @staticmethod
+    def receive(connections, processes, names):
+        """Receive one message from each connection. Raises RuntimeError if a process exits,
+        or closes its connection, before sending."""
+        messages = [None] * len(connections)
+        waiting = set(range(len(connections)))
+        while waiting:
+            ready = multiprocessing.connection.wait(
+                [connections[number] for number in waiting] +
+                [processes[number].sentinel for number in waiting])
+            for number in sorted(waiting):
+                connection = connections[number]
+                # Read sent message (if any) before checking whether process has exited
+                if connection in ready or connection.poll():
+                    try:
+                        messages[number] = connection.recv()
+                    except EOFError:
+                        raise RuntimeError('Process for %s closed its connection' %
+                                           names[number])
+                    waiting.remove(number)
+                elif processes[number].sentinel in ready:
+                    processes[number].join()
+                    raise RuntimeError('Process for %s exited (exit code %s)' %
+                                       (names[number], processes[number].exitcode))
+        return messages
+
+    def coordinate(self, connections, processes):
+        """Synchronise networks daily until all networks have finished. Returns results of
+        each network."""
+        owner = {}
+        owner_positions = []
+        hospital_networks = self.data.network_lookup['network']
+        for number, network_name in enumerate(self.networks):
+            positions = [self.data.hospital_index[hospital]
+                         for hospital in self.data.hospitals
+                         if hospital_networks.loc[hospital] == network_name]
+            owner_positions.append(positions)
+            for position in positions:
+                owner[self.data.hospitals[position]] = number
+
+        occupancy = np.zeros((len(self.data.hospitals), len(NetworkModel.occupancy_columns)))
+        while True:
+            messages = self.receive(connections, processes[:len(connections)],
+                                    ['network %s' % name for name in self.networks])
+            if all(message[0] == 'done' for message in messages):
+                return [message[1] for message in messages]
+            if any(message[0] == 'done' for message in messages):
+                raise RuntimeError('Network processes out of step')
+
+            imports = [[] for _ in connections]
+            releases = [[] for _ in connections]
+            for number, (_, own_occupancy, exports, released) in enumerate(messages):
+                occupancy[owner_positions[number]] = own_occupancy
+                for export in exports:
+                    imports[owner[export[0]]].append(export)
+                for release in released:
+                    releases[owner[release[0]]].append(release)
+            for number, connection in enumerate(connections):
+                connection.send((occupancy, imports[number], releases[number]))
+
+    def combine(self, network_results):
+        """Combine network audit tables and totals, and summarise as a national run"""
+        audit = Audit(self.config, Clock())
+        audit.set_up_output(None)
+        logs = {}
+        for table in ['general_day_audit', 'hospital_day_audit', 'patient_audit',
+                      'patient_log']:
+            logs[table] = pd.concat([result['logs'][table] for result in network_results],
+                                    ignore_index=True)
+
+        # General audit: patient counts summed over networks. Care level counts and workload
+        # from hospital audit (each network's general audit includes other networks'
+        # hospitals).
+        general = logs['general_day_audit'].groupby('day', as_index=False).agg(
+            dict({column: 'sum' for column in logs['general_day_audit'].columns
+                  if column != 'day'}, year='first'))
+        hospital_columns = Model.network_count_columns + ['current_workload']
+        hospital_by_day = logs['hospital_day_audit'].groupby('day')[hospital_columns].sum()
+        for column, hospital_column in zip(
+                ['surgery', 'level_1', 'level_2', 'level_3', 'level_4', 'nurse_workload'],
+                hospital_columns):
+            general[column] = hospital_by_day.loc[general['day'], hospital_column].values
+        logs['general_day_audit'] = general[logs['general_day_audit'].columns]
+        logs['hospital_day_audit'] = logs['hospital_day_audit'].sort_values(
+            'day', kind='mergesort')
+        logs['patient_log'] = logs['patient_log'].sort_values('time_out', kind='mergesort')
+
+        for table, log in logs.items():
+            audit.write_rows(table, log.values.tolist())
+        for name in self.audit_totals:
+            setattr(audit, name, sum(result['totals'][name] for result in network_results))
+        for result in network_results:
+            for name in ['distance_from_home_counts', 'travel_time_counts',
+                         'multiple_birth_counts']:
+                combined = getattr(audit, name)
+                for key, counts in result[name].items():
+                    if key not in combined:
+                        combined[key] = np.zeros_like(counts)
+                    combined[key] += counts
+
+        flows = Flows(list(self.data.lsoa_demand.index), self.data.hospitals)
+        for result in network_results:
+            for name in ['admissions', 'transfers']:
+                counts = getattr(flows, name)
+                for key, count in result[name].items():
+                    counts[key] += count
+
+        tables = Summarise(audit, flows).summarise()
+        results = Results(self.config, tables, logs, flows)
+        if self.config.write_output:
+            results.save()
+        if not self.config.keep_logs:
+            results.logs = {}
+        return results
+
+    @staticmethod
+    def compare_results(tables, monolithic_tables):
+        """Key outputs of partitioned and monolithic runs, with relative error"""
+        outputs = defaultdict(dict)
+        for name, source in [('partitioned', tables), ('monolithic', monolithic_tables)]:
+            general = source['summary_general']['mean']
+            for row in ['all infants', 'surgery', 'level_1', 'level_2', 'level_3', 'level_4',
+                        'nurse_workload', 'displaced']:
+                outputs[name]['mean ' + row] = general[row]
+            transfers = source['transfers_and_no_bed']
+            for row in ['transfers', 'transfer_distance', 'episodes_no_bed']:
+                outputs[name][row] = transfers[row]
+            workload = source['summary_nurse_workload']['mean']
+            for percentile in workload.index:
+                outputs[name]['workload %s percentile' % percentile] = workload[percentile]
+            travel = source['travel_greater_than_30_45_60']
+            for row in travel.index:
+                outputs[name]['fraction travel ' + row] = travel[row]
+        error = pd.DataFrame(outputs)
+        error['relative_error'] = ((error['partitioned'] - error['monolithic']) /
+                                   error['monolithic'].abs())
+        return error
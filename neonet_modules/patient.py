@@ -14,11 +14,14 @@ For info contact michael.allen1966@gmail.com
 import numpy as np
 import random
 
+from neonet_modules.streams import choose, choose_cumulative
+
 
 class Patient:
     """
      Attributes;
      'birth_hospital',
+     'birth_order',
      'category',
      'category_without_surgery',
      'closest_appropriate_hospital',
@@ -51,7 +54,11 @@ class Patient:
 
     """
 
-    def __init__(self, data, id, delivery, time_in, year):
+    def __init__(self, data, id, delivery, time_in, year, sibling_of=None, draws=None,
+                 lsoa_weights=None, lsoa_cumulative_weights=None):
+        """draws: optional ArrivalDraws (common random numbers) used in place of global
+        random number streams. lsoa_weights (and cumulative weights): LSOA demand weights for
+        selection of LSOA (default data weights)."""
 
         self.id = id
         self.delivery_id = delivery
@@ -64,11 +71,6 @@ class Patient:
         self.in_closest_appropriate_hospital = False
         self.in_home_network = False
         self.closest_appropriate_hospital = 'None'
-        # Set LSOA (by reading weights and selection)
-        weights = data.lsoa_demand['all_neonatal']
-        selection = data.lsoa_demand.index
-        self.lsoa = random.choices(selection, weights=weights)
-        self.lsoa = self.lsoa[0]
         self.birth_hospital = 'None'
         self.last_hopsital = 'None'
         self.complete = False
@@ -76,6 +78,35 @@ class Patient:
         self.transfers = 0
         self.total_transfer_distance = 0
 
+        if sibling_of is not None:
+            # Further infant of a multiple birth: LSOA, category and fetuses are shared
+            self.lsoa = sibling_of.lsoa
+            self.category = sibling_of.category_without_surgery
+            self.category_without_surgery = sibling_of.category_without_surgery
+            self.fetuses = sibling_of.fetuses
+            return
+
+        self.birth_order = 1
+        if lsoa_weights is None:
+            lsoa_weights = data.lsoa_weights
+            lsoa_cumulative_weights = data.lsoa_cumulative_weights
+
+        if draws is not None:
+            # Common random numbers: select by inverse of cumulative weights
+            self.lsoa = data.lsoa_demand.index[
+                choose_cumulative(lsoa_cumulative_weights, draws.lsoa)]
+            self.category = [int(choose(data.deliveries['percent_all_deliveries'].values,
+                                        draws.category))]
+            self.fetuses = int(choose(data.fetuses_matrix[self.category[0], :],
+                                      draws.fetuses)) + 1
+            return
+
+        # Set LSOA (by reading weights and selection)
+        weights = lsoa_weights
+        selection = data.lsoa_demand.index
+        self.lsoa = random.choices(selection, weights=weights)
+        self.lsoa = self.lsoa[0]
+
         # Set infant category
         weights = data.deliveries['percent_all_deliveries']
         selection = np.arange(len(weights))
@@ -88,13 +119,81 @@ class Patient:
         selection = np.arange(len(weights)) + 1
         self.fetuses = random.choices(selection, weights=weights)[0]
 
-    def set_care_requirements(self, data):
+    def create_siblings(self, data, first_id, draws=None):
+        """
+        Returns patients for the further infants of a multiple birth (twins etc), with ids
+        starting at first_id. Siblings share LSOA, delivery id and category (before surgery)
+        with this patient and are linked in audits by delivery id and birth order. Surgery
+        and lengths of stay for all siblings are each drawn in a single vectorised call;
+        the care pathway is then sampled for each sibling. If common random numbers (draws)
+        are used each sibling takes its own pre-drawn random numbers.
+        """
+        siblings = []
+        for i in range(self.fetuses - 1):
+            sibling = Patient(data, first_id + i, self.delivery_id, self.time_in, self.year,
+                              sibling_of=self)
+            sibling.birth_order = i + 2
+            siblings.append(sibling)
+
+        if draws is not None:
+            for sibling in siblings:
+                sibling.set_care_requirements(data, draws)
+            return siblings
+
+        # Surgery
+        prob_surgery_array = data.deliveries['percent_infants_surgical'].values
+        prob_surgery = prob_surgery_array[self.category_without_surgery[0]] / 100
+        surgery = np.random.binomial(1, prob_surgery, size=len(siblings))
+        for sibling, surgical in zip(siblings, surgery):
+            if surgical == 1:
+                sibling.category = [6]
+
+        # Lengths of stay
+        categories = [sibling.category[0] for sibling in siblings]
+        los = np.random.lognormal(data.los_ln_mu.values[categories, :],
+                                  data.los_ln_stdev.values[categories, :])
+
+        for sibling, sibling_los in zip(siblings, los):
+            sibling.set_care_pathway(data)
+            sibling.los = list(sibling_los)
+
+        return siblings
+
+    def set_care_requirements(self, data, draws=None):
         # set surgical category        # Set twins
         self.category_without_surgery = self.category
         prob_surgery_array = data.deliveries['percent_infants_surgical'].values
         prob_surgery = prob_surgery_array[self.category] / 100
+        if draws is not None:
+            # Common random numbers for this infant
+            infant = self.birth_order - 1
+            if draws.surgery[infant] < prob_surgery[0]:
+                self.category = [6]
+            self.set_care_pathway(data, draws)
+            self.los = list(np.exp(self.los_ln_mu[0] + self.los_ln_stdev[0] *
+                                   draws.los[infant]))
+            return
+
         if np.random.binomial(1, prob_surgery) == 1:
             self.category = [6]
+        transitions = self.set_care_pathway(data)
+
+        # Add lengths of stay
+        # Lengths of stay are sampled after each pathway transition and the last sample kept
+        # (keeps random number use the same as earlier versions)
+        for transition in range(transitions):
+            # loop through care levels
+            self.los = []
+            for care_level in range(5):
+                _los_mu = self.los_ln_mu[0][care_level]
+                _los_stdev = self.los_ln_stdev[0][care_level]
+                _los = np.random.lognormal(_los_mu, _los_stdev)
+                self.los.append(_los)
+
+    def set_care_pathway(self, data, draws=None):
+        """Sets entry level and levels of care used. Returns number of transitions."""
+        infant = self.birth_order - 1
+
         # Initially set all use to False. Set LoS by category
         self.use_levels = [False, False, False, False, False]
         self.los_ln_mu = data.los_ln_mu.values[self.category, :]
@@ -104,26 +203,27 @@ class Patient:
         weights = data.entry_matrix[self.category, :]
         weights = weights[0]
         selection = np.arange(len(weights))
-        self.entry = random.choices(selection, weights=weights)[0]
+        if draws is not None:
+            self.entry = int(choose(weights, draws.entry[infant]))
+        else:
+            self.entry = random.choices(selection, weights=weights)[0]
         self.use_levels[self.entry] = True
         self.required_care_level_current = self.entry
         last_assigned_level = self.entry
+        transitions = 0
 
         # Add further use levels
         while last_assigned_level < 5:
             weights = data.transition_matrix[last_assigned_level, self.category, :]
             weights = weights[0]
             selection = np.arange(len(weights))
-            next_assigned_level = random.choices(selection, weights=weights)[0]
+            if draws is not None:
+                next_assigned_level = int(choose(weights, draws.pathway[infant, transitions]))
+            else:
+                next_assigned_level = random.choices(selection, weights=weights)[0]
             if next_assigned_level < 5:
                 self.use_levels[next_assigned_level] = True
             last_assigned_level = next_assigned_level
+            transitions += 1
 
-            # Add lengths of stay
-            # loop through care levels
-            self.los = []
-            for care_level in range(5):
-                _los_mu = self.los_ln_mu[0][care_level]
-                _los_stdev = self.los_ln_stdev[0][care_level]
-                _los = np.random.lognormal(_los_mu, _los_stdev)
-                self.los.append(_los)
+        return transitions
@@ -0,0 +1,98 @@
+"""National neonatal demand and capacity model
+*** Requires Python 3.6 or greater***
+
+Class to report run progress and live metrics
+
+Version 170601
+
+(c)2017 Michael Allen
+This code is distributed under GNU GPL2
+https://www.gnu.org/licenses/old-licenses/gpl-2.0.en.html
+For info contact michael.allen1966@gmail.com
+"""
+
+import json
+import socket
+import time
+
+
+class Progress:
+    """
+    Reports simulated day, speed (days/s), estimated time to completion, live patients,
+    displaced patients and cumulative episodes with no bed found.
+
+    update() is called every simulated day but only reports when at least `interval`
+    seconds of wall-clock time have passed since the last report, so cost per call is a
+    single clock read. Reports are printed, and optionally appended to a JSON-lines file
+    and/or sent as UDP datagrams to a local (host, port) address for dashboards.
+    """
+
+    def __init__(self, sim_duration, interval=5.0, print_output=True, json_file=None,
+                 socket_address=None):
+        self.sim_duration = sim_duration
+        self.interval = interval
+        self.print_output = print_output
+        self.start_time = time.time()
+        self.last_report_time = self.start_time
+        self.last_report_day = 0
+        self.json_file = open(json_file, 'a') if json_file else None
+        self.socket_address = socket_address
+        self.socket = None
+        if socket_address:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.setblocking(False)
+
+    def update(self, day, network, audit):
+        """Report if reporting interval has passed"""
+        now = time.time()
+        if now - self.last_report_time >= self.interval:
+            self.report(day, network, audit, now)
+
+    def report(self, day, network, audit, now=None):
+        now = now if now is not None else time.time()
+        elapsed = now - self.start_time
+        interval_time = now - self.last_report_time
+        days_per_second = ((day - self.last_report_day) / interval_time if interval_time > 0
+                           else 0.0)
+        mean_days_per_second = day / elapsed if elapsed > 0 else 0.0
+        eta = ((self.sim_duration - day) / mean_days_per_second if mean_days_per_second > 0
+               else None)
+
+        metrics = {'time': now,
+                   'elapsed': elapsed,
+                   'day': day,
+                   'days_per_second': days_per_second,
+                   'eta_seconds': eta,
+                   'live_patients': len(network.patients),
+                   'displaced': len(network.displaced_patients_ids),
+                   'episodes_no_bed': audit.episodes_with_no_bed_found}
+
+        if self.print_output:
+            print('Day: %d of %d (%.1f days/s, ETA %s). Live patients: %d, displaced: %d, '
+                  'episodes with no bed: %d' % (day, self.sim_duration, days_per_second,
+                                                '%d s' % eta if eta is not None else '-',
+                                                metrics['live_patients'], metrics['displaced'],
+                                                metrics['episodes_no_bed']))
+
+        if self.json_file or self.socket:
+            line = json.dumps(metrics) + '\n'
+            if self.json_file:
+                self.json_file.write(line)
+                self.json_file.flush()
+            if self.socket:
+                try:
+                    self.socket.sendto(line.encode(), self.socket_address)
+                except OSError:
+                    # Dashboard not listening or buffer full; metrics are not critical
+                    pass
+
+        self.last_report_time = now
+        self.last_report_day = day
+
+    def close(self, day, network, audit):
+        """Final report, then close outputs"""
+        self.report(day, network, audit)
+        if self.json_file:
+            self.json_file.close()
+        if self.socket:
+            self.socket.close()
@@ -0,0 +1,331 @@
+"""National neonatal demand and capacity model
+*** Requires Python 3.6 or greater***
+
+Golden output regression harness
+
+Version 170601
+
+(c)2017 Michael Allen
+This code is distributed under GNU GPL2
+https://www.gnu.org/licenses/old-licenses/gpl-2.0.en.html
+For info contact michael.allen1966@gmail.com
+
+Usage (from the model folder):
+    python -m neonet_modules.regression record    # before changing the model
+    python -m neonet_modules.regression check     # after changing the model
+
+For changes that alter random number use, record golden replications (other seeds) and
+check summary outputs within a number of standard deviations of the replications:
+    python -m neonet_modules.regression record --replications 10
+    python -m neonet_modules.regression check --tolerance 4
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from neonet import Model
+from neonet_modules.config import Config
+from neonet_modules.data import Data
+
+# Model parameter tables copied unchanged into synthetic fixtures
+parameter_tables = ['deliveries.csv', 'entry_point.csv', 'exit_surgery.csv',
+                    'exit_level_1.csv', 'exit_level_2.csv', 'exit_level_3.csv',
+                    'exit_level_4.csv', 'fetuses.csv', 'los_ln_mu.csv', 'los_ln_stdev.csv']
+
+# Raw tables (compared exactly only; not comparable when random number use changes)
+raw_tables = ['general_day_audit.csv', 'hospital_day_audit.csv', 'patient_audit.csv',
+              'patient_log.csv', 'transfer_flows.csv']
+raw_table_prefixes = ['hospital_pivot_by_day_']
+
+# Scenarios: changes to base configuration. Each exercises a different part of the model.
+base_settings = {'warm_up': 20, 'duration': 60, 'arrivals_per_day': 20,
+                 'progress_interval': float('inf')}
+scenarios = {'default': {},
+             'common_random_numbers': {'crn_seed': 1},
+             'admission_queues': {'use_admission_queues': True},
+             'arrival_profile': {'arrival_profile': {
+                 'weekday_factors': [1.1, 1.1, 1.1, 1.1, 1.1, 0.75, 0.75],
+                 'seasonal_amplitude': 0.1, 'annual_growth': 0.02}},
+             'reservoir_sampling': {'patient_audit_sampling': 'reservoir',
+                                    'patient_audit_sample_size': 50}}
+
+
+def make_fixtures(folder, parameter_folder='data', hospitals=12, networks=3, lsoas=200,
+                  seed=1):
+    """
+    Write a small synthetic data set to folder: hospitals (one not current) and LSOAs placed
+    at random in a 200 km square, divided into networks by position, with travel times and
+    distances from straight line distance. Nurse capacity is low enough for some infants to
+    be displaced. Model parameter tables are copied from parameter_folder.
+    """
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    for table in parameter_tables:
+        shutil.copy(parameter_folder + '/' + table, folder + '/' + table)
+
+    rng = np.random.RandomState(seed)
+    hospital_xy = rng.uniform(0, 200, (hospitals + 1, 2))
+    lsoa_xy = rng.uniform(0, 200, (lsoas, 2))
+    postcodes = ['H%02d 1AA' % number for number in range(hospitals + 1)]
+
+    # Designation: first hospital of each network is a NICU (first network's is surgical),
+    # then alternately local neonatal units (LNU) and special care units (SCU)
+    hospital_info = pd.DataFrame({'hospital_postcode': postcodes})
+    hospital_info['hospital'] = ['Hospital %d' % number for number in range(hospitals + 1)]
+    hospital_info['city'] = 'Synthetic'
+    hospital_info['network'] = np.minimum((hospital_xy[:, 0] * networks / 200).astype(int),
+                                          networks - 1) + 1
+    hospital_info['neonatal_current'] = [1] * hospitals + [0]
+    first_in_network = ~hospital_info['network'].duplicated()
+    levels = []
+    for number in range(hospitals + 1):
+        if first_in_network[number]:
+            levels.append('NICU')
+        else:
+            levels.append('LNU' if number % 2 else 'SCU')
+    hospital_info['neonatal_level'] = levels
+    hospital_info['neonatal_surg'] = 0
+    hospital_info.loc[hospital_info.index[first_in_network][0], 'neonatal_surg'] = 1
+    hospital_info['neonatal_level_1'] = (hospital_info['neonatal_level'] == 'NICU').astype(int)
+    hospital_info['neonatal_level_2'] = (hospital_info['neonatal_level'] != 'SCU').astype(int)
+    hospital_info['neonatal_level_3'] = 1
+    hospital_info['neonatal_level_4'] = 1
+    hospital_info['nurse_capacity'] = rng.randint(3, 9, hospitals + 1)
+    hospital_info.to_csv(folder + '/hospital_info.csv', index=False)
+
+    # Travel time (minutes) and distance (km) from straight line distance
+    lsoa_names = ['LSOA %04d' % number for number in range(lsoas)]
+    lsoa_distance = np.sqrt(((lsoa_xy[:, None, :] - hospital_xy[None, :, :]) ** 2).sum(2))
+    travel = pd.DataFrame(np.round(5 + lsoa_distance * 1.2), index=lsoa_names,
+                          columns=postcodes).astype(int)
+    travel.to_csv(folder + '/travel_matrix_minutes.csv', index_label='LSOA')
+    hospital_distance = np.sqrt(
+        ((hospital_xy[:, None, :] - hospital_xy[None, :, :]) ** 2).sum(2))
+    pd.DataFrame(hospital_distance * 1.3, index=postcodes, columns=postcodes).to_csv(
+        folder + '/inter_hospital_d.csv', index_label='Hospital')
+    pd.DataFrame(np.round(hospital_distance * 1.2), index=postcodes, columns=postcodes).to_csv(
+        folder + '/inter_hospital_t.csv', index_label='Hospital')
+
+    # LSOA demand (region is network of nearest hospital position)
+    births = rng.gamma(4, 5, lsoas)
+    lsoa_demand = pd.DataFrame({'LSOA': lsoa_names})
+    lsoa_demand['SOA'] = ['Region %d' % region for region in
+                          np.minimum((lsoa_xy[:, 0] * networks / 200).astype(int),
+                                     networks - 1) + 1]
+    lsoa_demand['Births'] = births
+    lsoa_demand['all_neonatal'] = births * 0.13
+    lsoa_demand['VLBW'] = births * 0.011
+    lsoa_demand['ICU>24hrs'] = births * 0.018
+    lsoa_demand['HDU>24hrs'] = births * 0.024
+    lsoa_demand['SCU>24hrs'] = births * 0.107
+    lsoa_demand.to_csv(folder + '/predicted_neonatal_demand_by_lsoa.csv', index=False)
+
+
+def run_scenario(settings, fixture_folder, output_folder, seed=1):
+    """Run scenario with fixed seeds, writing all output tables to output_folder. Returns
+    data load and model run times (seconds)."""
+    config = Config.from_dict(dict(base_settings, data_folder=fixture_folder,
+                                   output_folder=output_folder, write_output=False,
+                                   keep_logs=True, **settings))
+    random.seed(seed)
+    np.random.seed(seed)
+    start = time.perf_counter()
+    data = Data(truncate=False, data_folder=fixture_folder)
+    loaded = time.perf_counter()
+    results = Model(config, data).run()
+    end = time.perf_counter()
+    if os.path.exists(output_folder):
+        shutil.rmtree(output_folder)
+    results.save()
+    return loaded - start, end - loaded
+
+
+def run_scenarios(fixture_folder, output_folder, seed=1, replications=1):
+    """Run all scenarios (in subfolders of output_folder) and save timings. With more than
+    one replication, replications with seeds seed + 1 ... are saved in replications
+    subfolders of each scenario folder."""
+    timings = pd.DataFrame(columns=['load_seconds', 'run_seconds'])
+    for name, settings in scenarios.items():
+        print('\nRegression scenario: %s' % name)
+        scenario_folder = output_folder + '/' + name
+        timings.loc[name] = run_scenario(settings, fixture_folder, scenario_folder, seed)
+        for replication in range(1, replications):
+            run_scenario(settings, fixture_folder, '%s/replications/seed_%d' %
+                         (scenario_folder, seed + replication), seed + replication)
+    timings.to_csv(output_folder + '/timings.csv', index_label='scenario')
+    return timings
+
+
+def is_raw(file):
+    name = os.path.basename(file)
+    return name in raw_tables or name.startswith(tuple(raw_table_prefixes))
+
+
+def output_files(folder):
+    """Output tables and flow matrices in folder (relative file names)"""
+    files = [file for file in os.listdir(folder) if file.endswith('.csv')]
+    if os.path.exists(folder + '/flows'):
+        files += ['flows/' + file for file in os.listdir(folder + '/flows')
+                  if file.endswith('.npz')]
+    return set(files)
+
+
+def read_values(file):
+    """Numeric cells of a summary table as a series keyed by (row, column), where rows are
+    identified by the first column and any other text columns. Flow matrices are read as
+    their total count (zero if the file is missing, as no flows were recorded)."""
+    if file.endswith('.npz'):
+        # scipy is imported here so it is needed only to compare flows
+        import scipy.sparse
+        total = scipy.sparse.load_npz(file).sum() if os.path.exists(file) else 0
+        return pd.Series({('all', 'total'): float(total)})
+    if not os.path.exists(file):
+        return pd.Series(dtype=np.float64)
+    table = pd.read_csv(file)
+    keys = [table.columns[0]] + [column for column in table.columns[1:]
+                                 if not pd.api.types.is_numeric_dtype(table[column])]
+    values = table.set_index(keys).select_dtypes('number').astype(np.float64)
+    values.index = values.index.map(str)
+    return values.stack()
+
+
+def compare_file(golden_file, file, tolerance=None, replication_files=()):
+    """
+    Compare output file with golden file. Returns (status, maximum difference in standard
+    deviations).
+
+    Without tolerance, tables must be identical and flow matrices must have identical counts.
+    With tolerance, raw tables are not compared, and each summary table cell (or flow matrix
+    total) must be within tolerance standard deviations of the golden replications
+    (golden_file and replication_files): |value - mean| <= tolerance * sd * sqrt(1 + 1/n).
+    Cells missing from any golden replication (rare rows) are not compared.
+    """
+    if tolerance is not None and is_raw(file):
+        return 'not compared', np.nan
+
+    if tolerance is None:
+        if not os.path.exists(file):
+            return 'missing', np.nan
+        if not os.path.exists(golden_file):
+            return 'unexpected', np.nan
+        if file.endswith('.npz'):
+            import scipy.sparse
+            golden = scipy.sparse.load_npz(golden_file)
+            current = scipy.sparse.load_npz(file)
+            identical = golden.shape == current.shape and (golden != current).nnz == 0
+        else:
+            with open(golden_file, 'rb') as f1, open(file, 'rb') as f2:
+                identical = f1.read() == f2.read()
+        return ('identical', 0.0) if identical else ('different', np.nan)
+
+    if not file.endswith('.npz') and not os.path.exists(file):
+        return 'missing', np.nan
+    golden = pd.concat([read_values(golden_file)] +
+                       [read_values(replication_file) for replication_file in
+                        replication_files], axis=1)
+    current = read_values(file).reindex(golden.index)
+    count = golden.count(axis=1)
+    mean = golden.mean(axis=1)
+    scale = golden.std(axis=1) * np.sqrt(1 + 1 / count)
+    compared = (count == golden.shape[1]) & (count >= 2)
+    lost = compared & current.isnull()
+    difference = (current - mean).abs()[compared & ~lost]
+    scale = scale[difference.index]
+    # Cells constant over golden replications must be unchanged
+    standardised = (difference / scale).where(scale > 0, np.where(
+        difference <= 1e-9 * np.maximum(mean[difference.index].abs(), 1), 0.0, np.inf))
+    max_difference = standardised.max() if len(standardised) else 0.0
+    if lost.any():
+        return 'different', np.inf
+    if max_difference <= tolerance:
+        return 'within tolerance', max_difference
+    return 'different', max_difference
+
+
+def check(golden_folder, fixture_folder, output_folder, tolerance=None, seed=1):
+    """Run scenarios and compare outputs with golden outputs. With tolerance, summary tables
+    and flow totals may differ by up to tolerance standard deviations of golden replications
+    (see compare_file) and raw tables are not compared. Returns True if all outputs pass."""
+    if tolerance is not None:
+        for name in scenarios:
+            if not os.path.exists(golden_folder + '/' + name + '/replications'):
+                raise ValueError('Golden outputs for %s have no replications: record with '
+                                 '--replications (e.g. 10) to check with --tolerance' % name)
+
+    timings = run_scenarios(fixture_folder, output_folder, seed)
+    golden_timings = pd.read_csv(golden_folder + '/timings.csv', index_col='scenario')
+
+    report = []
+    for name in scenarios:
+        golden_scenario = golden_folder + '/' + name
+        scenario = output_folder + '/' + name
+        if not os.path.exists(golden_scenario):
+            report.append({'scenario': name, 'file': '', 'status': 'no golden output',
+                           'max_difference': np.nan})
+            continue
+        replication_folders = []
+        if os.path.exists(golden_scenario + '/replications'):
+            replication_folders = [golden_scenario + '/replications/' + folder for folder in
+                                   sorted(os.listdir(golden_scenario + '/replications'))]
+        files = output_files(golden_scenario) | output_files(scenario)
+        for folder in replication_folders:
+            files |= output_files(folder)
+        for file in sorted(files):
+            status, difference = compare_file(
+                golden_scenario + '/' + file, scenario + '/' + file, tolerance,
+                [folder + '/' + file for folder in replication_folders])
+            report.append({'scenario': name, 'file': file, 'status': status,
+                           'max_difference': difference})
+    report = pd.DataFrame(report, columns=['scenario', 'file', 'status', 'max_difference'])
+    report.to_csv(output_folder + '/regression_report.csv', index=False)
+
+    timings['golden_run_seconds'] = golden_timings['run_seconds']
+    timings['run_time_ratio'] = timings['run_seconds'] / timings['golden_run_seconds']
+    timings.to_csv(output_folder + '/timings.csv', index_label='scenario')
+
+    failed = report.loc[~report['status'].isin(['identical', 'within tolerance',
+                                                'not compared'])]
+    print('\nRegression check: %d files compared, %d failed' % (len(report), len(failed)))
+    if len(failed):
+        print(failed.to_string(index=False))
+    print('\nTimings (seconds):')
+    print(timings.to_string())
+    return len(failed) == 0
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Golden output regression harness')
+    parser.add_argument('action', choices=['record', 'check'])
+    parser.add_argument('--golden', default='output/regression/golden',
+                        help='folder of golden outputs')
+    parser.add_argument('--output', default='output/regression/current',
+                        help='folder for outputs of check')
+    parser.add_argument('--fixtures', default='output/regression/fixtures',
+                        help='folder for synthetic data')
+    parser.add_argument('--tolerance', type=float, default=None,
+                        help='allowed difference of summary outputs (standard deviations of '
+                             'golden replications)')
+    parser.add_argument('--replications', type=int, default=1,
+                        help='golden replications to record (for --tolerance)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    parsed = parser.parse_args(args)
+
+    make_fixtures(parsed.fixtures)
+    if parsed.action == 'record':
+        run_scenarios(parsed.fixtures, parsed.golden, parsed.seed, parsed.replications)
+        print('\nGolden outputs recorded in %s' % parsed.golden)
+        return 0
+    passed = check(parsed.golden, parsed.fixtures, parsed.output, parsed.tolerance,
+                   parsed.seed)
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
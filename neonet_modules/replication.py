@@ -0,0 +1,114 @@
+"""National neonatal demand and capacity model
+*** Requires Python 3.6 or greater***
+
+Class to run replications until precision targets are met
+
+Version 170601
+
+(c)2017 Michael Allen
+This code is distributed under GNU GPL2
+https://www.gnu.org/licenses/old-licenses/gpl-2.0.en.html
+For info contact michael.allen1966@gmail.com
+"""
+
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+
+from neonet_modules.summarise import Summarise
+
+
+class ReplicationController:
+    """Runs model replications in parallel rounds until key outputs meet precision targets"""
+
+    default_targets = {'nurse_workload': 0.02,
+                       'displaced': 0.10,
+                       'episodes_no_bed': 0.10,
+                       'transfer_distance': 0.05}
+
+    def __init__(self, run_function, output_folder, targets=None, confidence=0.95,
+                 workers=None, min_replications=3, max_replications=50, base_seed=1):
+        self.run_function = run_function
+        self.output_folder = output_folder
+        self.targets = targets if targets is not None else self.default_targets
+        self.confidence = confidence
+        self.workers = workers if workers else multiprocessing.cpu_count()
+        self.min_replications = max(min_replications, 2)
+        self.max_replications = max_replications
+        self.base_seed = base_seed
+        self.results = pd.DataFrame()
+
+    @staticmethod
+    def read_outputs(folder):
+        """Read key outputs of one replication from its output folder"""
+        general = Summarise.read(folder, 'summary_general')
+        transfers = Summarise.read(folder, 'transfers_and_no_bed').iloc[:, 0]
+        outputs = pd.Series()
+        outputs['nurse_workload'] = general.loc['nurse_workload', 'mean']
+        outputs['displaced'] = general.loc['displaced', 'mean']
+        outputs['episodes_no_bed'] = transfers['episodes_no_bed']
+        outputs['transfer_distance'] = transfers['transfer_distance']
+        return outputs
+
+    def precision(self):
+        """Mean, confidence interval half-width and relative precision of key outputs"""
+        # scipy is imported here so it is needed only to run replications
+        from scipy import stats
+        results = self.results[list(self.targets)]
+        n = len(results)
+        t_value = stats.t.ppf((1 + self.confidence) / 2, n - 1)
+        precision = pd.DataFrame()
+        precision['mean'] = results.mean()
+        precision['half_width'] = t_value * results.std() / np.sqrt(n)
+        precision['relative_half_width'] = (precision['half_width'] /
+                                            precision['mean'].abs())
+        # Outputs with zero mean and zero variance are precise
+        precision.loc[precision['half_width'] == 0, 'relative_half_width'] = 0.0
+        precision['target'] = pd.Series(self.targets)
+        precision['met'] = precision['relative_half_width'] <= precision['target']
+        precision['replications'] = n
+        return precision
+
+    def run_round(self, first_replication, replications):
+        tasks = []
+        for replication in range(first_replication, first_replication + replications):
+            folder = '%s/replication_%03d' % (self.output_folder, replication)
+            tasks.append((replication, self.base_seed + replication, folder))
+
+        with multiprocessing.Pool(processes=self.workers, maxtasksperchild=1) as pool:
+            pool.starmap(self.run_function, tasks)
+
+        for (replication, seed, folder) in tasks:
+            self.results.loc[replication, 'seed'] = seed
+            outputs = self.read_outputs(folder)
+            for key in self.targets:
+                self.results.loc[replication, key] = outputs[key]
+
+    def run(self):
+        if not os.path.exists(self.output_folder):
+            os.makedirs(self.output_folder)
+
+        replications = 0
+        while True:
+            # First round runs at least minimum replications, then one replication per worker
+            round_size = max(self.workers, self.min_replications - replications)
+            round_size = min(round_size, self.max_replications - replications)
+            self.run_round(replications, round_size)
+            replications += round_size
+
+            precision = self.precision()
+            print('\nReplications: %d' % replications)
+            print(precision)
+            self.results.to_csv(self.output_folder + '/replication_results.csv')
+            precision.to_csv(self.output_folder + '/replication_precision.csv')
+
+            if precision['met'].all():
+                print('Precision targets met after %d replications' % replications)
+                break
+            if replications >= self.max_replications:
+                print('Maximum replications reached before precision targets met')
+                break
+
+        return precision
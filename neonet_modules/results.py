@@ -0,0 +1,63 @@
+"""National neonatal demand and capacity model
+*** Requires Python 3.6 or greater***
+
+Class to hold results of a model run
+
+Version 170601
+
+(c)2017 Michael Allen
+This code is distributed under GNU GPL2
+https://www.gnu.org/licenses/old-licenses/gpl-2.0.en.html
+For info contact michael.allen1966@gmail.com
+"""
+
+import os
+
+from neonet_modules.summarise import Summarise
+
+
+class Results:
+    """
+    Results of a model run (returned by Model.run):
+    config: run configuration
+    tables: summary tables by name (see Summarise), e.g. results['summary_general']
+    logs: audit tables by name as DataFrames (general_day_audit, hospital_day_audit,
+          patient_audit, patient_log) if kept in memory (Config keep_logs), otherwise empty
+    flows: LSOA -> hospital and transfer flow counts (Flows)
+    memory: memory tables by name (see MemoryMonitor.report) if memory monitored, otherwise
+            None
+
+    Nothing is written to disk unless save is called (Model.run saves results to the
+    configured output folder when Config write_output is True).
+    """
+
+    def __init__(self, config, tables, logs, flows, memory=None):
+        self.config = config
+        self.tables = tables
+        self.logs = logs
+        self.flows = flows
+        self.memory = memory
+
+    def __getitem__(self, name):
+        return self.tables[name]
+
+    def save(self, output_folder=None, save_logs=True):
+        """Write summary tables (in configured output format), flows, memory tables (in
+        memory subfolder) and (if save_logs) audit tables kept in memory to output_folder
+        (default configured output folder)"""
+        if output_folder is None:
+            output_folder = self.config.output_folder
+        Summarise.save(self.tables, output_folder, self.config.output_format)
+        self.flows.save(output_folder)
+        if self.memory is not None:
+            memory_folder = output_folder + '/memory'
+            if not os.path.exists(memory_folder):
+                os.makedirs(memory_folder)
+            for name, table in self.memory.items():
+                table.to_csv(memory_folder + '/' + name + '.csv', index=False)
+        if save_logs:
+            for name, log in self.logs.items():
+                if self.config.output_format == 'parquet':
+                    log.to_parquet(output_folder + '/' + name + '.parquet', index=False)
+                else:
+                    log.to_csv(output_folder + '/' + name + '.csv', index=False)
@@ -0,0 +1,97 @@
+"""National neonatal demand and capacity model
+*** Requires Python 3.6 or greater***
+
+Class to provide common random numbers for arrivals
+
+Version 170601
+
+(c)2017 Michael Allen
+This code is distributed under GNU GPL2
+https://www.gnu.org/licenses/old-licenses/gpl-2.0.en.html
+For info contact michael.allen1966@gmail.com
+"""
+
+import numpy as np
+
+
+def choose(weights, u):
+    """Select index from weights using uniform random number u (as random.choices)"""
+    cumulative_weights = np.cumsum(weights)
+    return choose_cumulative(cumulative_weights, u)
+
+
+def choose_cumulative(cumulative_weights, u):
+    """Select index from cumulative weights using uniform random number u"""
+    index = np.searchsorted(cumulative_weights, u * cumulative_weights[-1], side='right')
+    return min(index, len(cumulative_weights) - 1)
+
+
+class ArrivalDraws:
+    """Random numbers for one arrival (delivery). Per-infant draws are indexed by birth order
+    - 1; pathway and lengths of stay by infant then transition/care level."""
+
+    def __init__(self, interarrival, lsoa, category, fetuses, surgery, entry, pathway, los):
+        self.interarrival = interarrival  # standard exponential
+        self.lsoa = lsoa  # uniform
+        self.category = category  # uniform
+        self.fetuses = fetuses  # uniform
+        self.surgery = surgery  # uniform per infant
+        self.entry = entry  # uniform per infant
+        self.pathway = pathway  # uniform per infant and transition
+        self.los = los  # standard normal per infant and care level
+
+
+class RandomStreams:
+    """
+    Common random numbers (CRN). Each arrival's attributes are drawn from dedicated streams for
+    each purpose (interarrival time, LSOA, category, fetuses, surgery, entry level, pathway,
+    lengths of stay), keyed by arrival index. The random numbers used by an arrival therefore
+    do not depend on model behaviour, and two scenarios run with the same seed see exactly the
+    same sequence of patients.
+
+    Random numbers are generated in batches of arrivals. The stream for each purpose and batch
+    is seeded from (seed, purpose, batch number), so any arrival index can be generated
+    directly.
+    """
+
+    max_fetuses = 5
+    max_transitions = 5
+    care_levels = 5
+
+    # Shape of random numbers for each arrival, by purpose
+    purposes = [('interarrival', ()),
+                ('lsoa', ()),
+                ('category', ()),
+                ('fetuses', ()),
+                ('surgery', (max_fetuses,)),
+                ('entry', (max_fetuses,)),
+                ('pathway', (max_fetuses, max_transitions)),
+                ('los', (max_fetuses, care_levels))]
+
+    def __init__(self, seed, batch_size=4096):
+        self.seed = seed
+        self.batch_size = batch_size
+        self.batch_number = None
+        self.batch = {}
+
+    def generate_batch(self, batch_number):
+        self.batch = {}
+        for purpose_number, (purpose, shape) in enumerate(self.purposes):
+            seed_sequence = np.random.SeedSequence(self.seed,
+                                                   spawn_key=(purpose_number, batch_number))
+            generator = np.random.default_rng(seed_sequence)
+            size = (self.batch_size,) + shape
+            if purpose == 'interarrival':
+                self.batch[purpose] = generator.standard_exponential(size)
+            elif purpose == 'los':
+                self.batch[purpose] = generator.standard_normal(size)
+            else:
+                self.batch[purpose] = generator.random(size)
+        self.batch_number = batch_number
+
+    def arrival(self, index):
+        """Returns ArrivalDraws for arrival index (0 or greater)"""
+        batch_number, row = divmod(index, self.batch_size)
+        if batch_number != self.batch_number:
+            self.generate_batch(batch_number)
+        return ArrivalDraws(*[self.batch[purpose][row] for purpose, shape in self.purposes])
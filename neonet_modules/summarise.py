@@ -11,15 +11,32 @@ https://www.gnu.org/licenses/old-licenses/gpl-2.0.en.html
 For info contact michael.allen1966@gmail.com
 """
 
+import os
 import pandas as pd
 import numpy as np
 
 
 class Summarise:
-    def __init__(self, audit, output_folder):
+    """
+    Summary tables of a model run, from audit tables (read from Audit, in memory or CSV), run
+    totals and flows (Flows). Tables are keyed by name (saved as name + '.csv', or name +
+    '.parquet', by save).
+
+    Usage:
+        tables = Summarise(audit, flows).summarise()
+        Summarise.save(tables, output_folder)
+    """
+
+    def __init__(self, audit, flows):
+        self.audit = audit
+        self.flows = flows
+
+    def summarise(self):
+        audit = self.audit
+        tables = {}
 
         # Summarise general audit
-        general_audit = pd.read_csv(output_folder + '/general_day_audit.csv')
+        general_audit = audit.read_table('general_day_audit')
         print('Summarising general audit')
         df_general = pd.DataFrame()
         general_by_year = general_audit.groupby('year').mean()
@@ -31,8 +48,7 @@ class Summarise:
         df_general['50%'] = general_by_year.quantile(0.5)
         df_general['75%'] = general_by_year.quantile(0.75)
         df_general['90%'] = general_by_year.quantile(0.9)
-        df_general.to_csv(output_folder + '/summary_general.csv')
-        del df_general
+        tables['summary_general'] = df_general
         del general_audit
         del general_by_year
 
@@ -43,12 +59,25 @@ class Summarise:
         df_transfers['transfer_time'] = audit.total_transfer_time
         df_transfers['episodes_no_bed'] = audit.episodes_with_no_bed_found
         df_transfers['los_no_bed'] = audit.total_episodes_length_with_no_bed_found
-        df_transfers.to_csv(output_folder + '/transfers_and_no_bed.csv')
-        del df_transfers
+        df_transfers['admissions_from_queue'] = audit.admissions_from_queue
+        df_transfers['queue_wait'] = audit.total_queue_wait
+        tables['transfers_and_no_bed'] = df_transfers
+
+        # Save transfer flows between hospital pairs (pairs with at least one transfer after
+        # warm up)
+        hospitals = pd.Index(self.flows.hospitals)
+        transfer_counts = self.flows.transfer_totals()
+        from_index, to_index = np.nonzero(transfer_counts)
+        transfer_flows = pd.DataFrame()
+        transfer_flows['from'] = hospitals[from_index]
+        transfer_flows['to'] = hospitals[to_index]
+        transfer_flows['transfers'] = transfer_counts[from_index, to_index]
+        transfer_flows.sort_values('transfers', ascending=False, inplace=True)
+        tables['transfer_flows'] = transfer_flows
 
         # Summarise patient log
         print('Summarising patient log')
-        patient_log = pd.read_csv(output_folder + '/patient_log.csv')
+        patient_log = audit.read_table('patient_log')
         df_patient_log = pd.DataFrame()
         patient_log_by_year = patient_log.groupby('year').mean()
         df_patient_log['mean'] = patient_log_by_year.mean()
@@ -59,16 +88,16 @@ class Summarise:
         df_patient_log['50%'] = patient_log_by_year.quantile(0.5)
         df_patient_log['75%'] = patient_log_by_year.quantile(0.75)
         df_patient_log['90%'] = patient_log_by_year.quantile(0.9)
-        df_patient_log.to_csv(output_folder + '/summary_patient_log.csv')
-        del df_patient_log
+        tables['summary_patient_log'] = df_patient_log
         del patient_log
         del patient_log_by_year
 
-        # Summarise patient
+        # Summarise patient audit (rows weighted by live patients each sampled patient
+        # represents, so means are not biased by audit sampling)
         print('Summarising patient audit')
-        patient_audit = pd.read_csv(output_folder + '/patient_audit.csv')
+        patient_audit = audit.read_table('patient_audit')
         df_patient_audit = pd.DataFrame()
-        patient_audit_by_year = patient_audit.groupby('year').mean()
+        patient_audit_by_year = self.weighted_mean_by_year(patient_audit, 'weight')
         df_patient_audit['mean'] = patient_audit_by_year.mean()
         df_patient_audit['std'] = patient_audit_by_year.std()
         df_patient_audit['count'] = patient_audit_by_year.count()
@@ -77,24 +106,51 @@ class Summarise:
         df_patient_audit['50%'] = patient_audit_by_year.quantile(0.5)
         df_patient_audit['75%'] = patient_audit_by_year.quantile(0.75)
         df_patient_audit['90%'] = patient_audit_by_year.quantile(0.9)
-        df_patient_audit.to_csv(output_folder + '/summary_patient_audit.csv')
+        tables['summary_patient_audit'] = df_patient_audit
 
         # then count patients more than 30, 45 and 60 min from home
-        results=pd.Series()
-        results['greater_than_30']=(patient_audit['distance_from_home']>30).mean()
-        results['greater_than_45']=(patient_audit['distance_from_home']>45).mean()
-        results['greater_than_60']=(patient_audit['distance_from_home']>60).mean()
-        results.to_csv(output_folder + '/travel_greater_than_30_45_60.csv')
+        # (from distance counts of all audited patients, so not affected by audit sampling)
+        distance_counts = np.zeros(audit.max_distance_bin + 1, dtype=np.int64)
+        for counts in audit.distance_from_home_counts.values():
+            distance_counts += counts
+        results = pd.Series()
+        results['greater_than_30'] = self.fraction_greater_than(distance_counts, 30)
+        results['greater_than_45'] = self.fraction_greater_than(distance_counts, 45)
+        results['greater_than_60'] = self.fraction_greater_than(distance_counts, 60)
+        tables['travel_greater_than_30_45_60'] = results
+
+        # Distance from home quantiles and fraction over 30, 45 and 60 min by year
+        distance_by_year = pd.DataFrame()
+        for year, counts in sorted(audit.distance_from_home_counts.items()):
+            for quantile in [0.1, 0.25, 0.5, 0.75, 0.9]:
+                distance_by_year.loc[year, quantile] = self.histogram_quantile(counts, quantile)
+            for minutes in [30, 45, 60]:
+                distance_by_year.loc[year, 'greater_than_%d' % minutes] = (
+                    self.fraction_greater_than(counts, minutes))
+        distance_by_year.index.name = 'year'
+        tables['summary_distance_from_home'] = distance_by_year
+
+        # Travel time from home at each placement by care level and home network (all years)
+        tables['summary_travel_time_by_care_level_and_network'] = self.travel_time_summary(
+            audit.travel_time_counts)
+
+        # Multiple births: fraction of audited deliveries with all siblings in the same unit
+        # (from counts of all live patients, so not affected by audit sampling)
+        multiple_birth_counts = np.zeros(2, dtype=np.int64)
+        for counts in audit.multiple_birth_counts.values():
+            multiple_birth_counts += counts
+        deliveries, same_unit = multiple_birth_counts
+        results = pd.Series()
+        results['deliveries_audited'] = deliveries
+        results['all_siblings_in_same_unit'] = same_unit / deliveries if deliveries else np.nan
+        tables['multiple_births_same_unit'] = results
 
         del patient_audit
-        del df_patient_audit
         del patient_audit_by_year
-        del results
 
         # Summarise hospital audit
         print('Summarising hospital audit')
-        filename = output_folder + '/hospital_day_audit.csv'
-        hosp_audit = pd.read_csv(output_folder + '/hospital_day_audit.csv')
+        hosp_audit = audit.read_table('hospital_day_audit')
         workload_percentile_by_year = pd.DataFrame()
         # Sum workloads at different percentiles (e.g. 50 is calculate median workload at each
         # hospital and sum)
@@ -112,38 +168,33 @@ class Summarise:
         total_nurse_workload['0.50'] = workload_percentile_by_year.quantile(0.50)
         total_nurse_workload['0.75'] = workload_percentile_by_year.quantile(0.75)
         total_nurse_workload['0.90'] = workload_percentile_by_year.quantile(0.90)
-        total_nurse_workload.to_csv(output_folder + '/summary_nurse_workload.csv')
-        del hosp_audit
+        tables['summary_nurse_workload'] = total_nurse_workload
         del workload_percentile_by_year
         del pivot
-        del total_nurse_workload
 
         # Summarise hospital by day
-        hospital_day_audit = pd.read_csv(output_folder + '/hospital_day_audit.csv')
+        hospital_day_audit = hosp_audit
 
         for item in ['current_workload', 'current_surgery', 'current_level_1', 'current_level_2',
                      'current_level_3', 'current_level_4', 'all_infant']:
             pivot = hospital_day_audit.pivot_table(index='day', columns='hospital', values=item)
-            file_name = '/hospital_pivot_by_day_' + item + '.csv'
-            pivot.to_csv(output_folder + file_name)
+            tables['hospital_pivot_by_day_' + item] = pivot
 
         # Stats for each hospital
-        file_list = ['hospital_pivot_by_day_current_surgery.csv',
-                     'hospital_pivot_by_day_current_level_1.csv',
-                     'hospital_pivot_by_day_current_level_2.csv',
-                     'hospital_pivot_by_day_current_level_3.csv',
-                     'hospital_pivot_by_day_current_level_4.csv',
-                     'hospital_pivot_by_day_all_infant.csv',
-                     'hospital_pivot_by_day_current_workload.csv']
+        table_list = ['hospital_pivot_by_day_current_surgery',
+                      'hospital_pivot_by_day_current_level_1',
+                      'hospital_pivot_by_day_current_level_2',
+                      'hospital_pivot_by_day_current_level_3',
+                      'hospital_pivot_by_day_current_level_4',
+                      'hospital_pivot_by_day_all_infant',
+                      'hospital_pivot_by_day_current_workload']
         column_names = ['surgery', 'level_1', 'level_2', 'level_3', 'level_4', 'infants',
                         'workload']
 
         summary_df = pd.DataFrame()
 
         for i in range(7):
-            file_name = output_folder + '/' + file_list[i]
-            data = pd.read_csv(file_name)
-            del data['day']
+            data = tables[table_list[i]]
             summary_df[column_names[i] + '_mean'] = data.mean()
             summary_df[column_names[i] + '_stdev'] = data.std()
             summary_df[column_names[i] + '_10_percentile'] = data.quantile(0.1)
@@ -152,4 +203,92 @@ class Summarise:
             summary_df[column_names[i] + '_75_percentile'] = data.quantile(0.75)
             summary_df[column_names[i] + '_90_percentile'] = data.quantile(0.90)
 
-        summary_df.to_csv(output_folder + '/summary_by_hospital.csv')
+        tables['summary_by_hospital'] = summary_df
+        return tables
+
+    output_formats = ['csv', 'parquet']
+
+    @classmethod
+    def check_output_format(cls, output_format):
+        """Raise error if output format is unknown or its library is not installed (checked
+        before a run, rather than when output is saved)"""
+        if output_format not in cls.output_formats:
+            raise ValueError('Unknown output format %r (use %s)' %
+                             (output_format, ' or '.join(cls.output_formats)))
+        if output_format == 'parquet':
+            try:
+                import pyarrow
+            except ImportError:
+                raise ImportError('pyarrow is required for parquet output')
+
+    @staticmethod
+    def save(tables, output_folder, output_format='csv'):
+        """Write summary tables to CSV or parquet files in output_folder"""
+        if not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+        for name, table in tables.items():
+            # Transfer flows are a list of hospital pairs (no index)
+            index = name != 'transfer_flows'
+            if output_format == 'parquet':
+                # Parquet stores tables (not series) with string column names
+                if isinstance(table, pd.Series):
+                    table = table.to_frame()
+                table.rename(columns=str).to_parquet(output_folder + '/' + name + '.parquet',
+                                                     index=index)
+            else:
+                table.to_csv(output_folder + '/' + name + '.csv', index=index)
+
+    @staticmethod
+    def read(output_folder, name):
+        """Read saved summary table (with index) from parquet file if present, otherwise
+        from CSV file"""
+        filename = output_folder + '/' + name
+        if os.path.exists(filename + '.parquet'):
+            return pd.read_parquet(filename + '.parquet')
+        return pd.read_csv(filename + '.csv', index_col=0)
+
+    @staticmethod
+    def weighted_mean_by_year(table, weight):
+        """Weighted mean of numeric columns by year (missing values excluded, as for
+        DataFrame.mean)"""
+        values = table.drop(columns=['year', weight]).select_dtypes(include=['number', 'bool'])
+        weights = table[weight]
+        weighted_sums = values.mul(weights, axis=0).groupby(table['year']).sum()
+        weight_sums = values.notnull().mul(weights, axis=0).groupby(table['year']).sum()
+        return weighted_sums / weight_sums
+
+    @classmethod
+    def travel_time_summary(cls, travel_time_counts):
+        """Placements, travel time quantiles and fraction over 30, 45 and 60 min, by care
+        level and home network (and all networks), from travel time counts by year"""
+        counts_by_key = {}
+        for (year, care_level, network), counts in travel_time_counts.items():
+            for key in [(care_level, str(network)), (care_level, 'all')]:
+                if key not in counts_by_key:
+                    counts_by_key[key] = np.zeros_like(counts)
+                counts_by_key[key] += counts
+
+        summary = pd.DataFrame(columns=['care_level', 'network', 'placements', '50%', '90%',
+                                        'greater_than_30', 'greater_than_45',
+                                        'greater_than_60'])
+        for care_level, network in sorted(counts_by_key):
+            counts = counts_by_key[(care_level, network)]
+            summary.loc[len(summary)] = [
+                care_level, network, counts.sum(), cls.histogram_quantile(counts, 0.5),
+                cls.histogram_quantile(counts, 0.9), cls.fraction_greater_than(counts, 30),
+                cls.fraction_greater_than(counts, 45), cls.fraction_greater_than(counts, 60)]
+        return summary.set_index(['care_level', 'network'])
+
+    @staticmethod
+    def fraction_greater_than(counts, minutes):
+        """Fraction of counts in 1 minute bins (bin n is > n-1 and <= n) above minutes"""
+        total = counts.sum()
+        return counts[minutes + 1:].sum() / total if total > 0 else np.nan
+
+    @staticmethod
+    def histogram_quantile(counts, quantile):
+        """Quantile (minutes) from counts in 1 minute bins (bin n is > n-1 and <= n)"""
+        total = counts.sum()
+        if total == 0:
+            return np.nan
+        return np.searchsorted(np.cumsum(counts), quantile * total)
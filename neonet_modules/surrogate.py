@@ -0,0 +1,122 @@
+"""National neonatal demand and capacity model
+*** Requires Python 3.6 or greater***
+
+Class to fit a surrogate (metamodel) to scenario results
+
+Version 170601
+
+(c)2017 Michael Allen
+This code is distributed under GNU GPL2
+https://www.gnu.org/licenses/old-licenses/gpl-2.0.en.html
+For info contact michael.allen1966@gmail.com
+"""
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import ConstantKernel, RBF, WhiteKernel
+from sklearn.preprocessing import StandardScaler
+
+from neonet_modules.summarise import Summarise
+
+
+class Surrogate:
+    """Surrogate (metamodel) of model outputs, fitted to completed scenario results, to predict
+    outputs of new network configurations"""
+
+    def __init__(self, outputs, features=None, method='gp'):
+        self.outputs = outputs
+        self.features = features
+        self.method = method
+        self.scaler = StandardScaler()
+        self.models = {}
+
+    @staticmethod
+    def scenario_features(hospital_info_df, allowed_overload_fraction):
+        """Features of a network configuration from hospital info (current units only)"""
+        hospitals = hospital_info_df.loc[hospital_info_df['neonatal_current'] == 1]
+        features = pd.Series()
+        features['allowed_overload_fraction'] = allowed_overload_fraction
+        features['total_nurse_capacity'] = hospitals['nurse_capacity'].sum()
+        designations = ['neonatal_surg', 'neonatal_level_1', 'neonatal_level_2',
+                        'neonatal_level_3', 'neonatal_level_4']
+        for designation in designations:
+            features['units_' + designation] = hospitals[designation].sum()
+        for _, hospital in hospitals.iterrows():
+            postcode = hospital['hospital_postcode']
+            features['capacity_' + postcode] = hospital['nurse_capacity']
+            for designation in designations:
+                features[designation + '_' + postcode] = hospital[designation]
+        return features
+
+    @staticmethod
+    def scenario_outputs(output_folder):
+        """Outputs of a completed model run, read from Summarise output files (CSV or
+        parquet)"""
+        workload = Summarise.read(output_folder, 'summary_nurse_workload')
+        general = Summarise.read(output_folder, 'summary_general')
+        transfers = Summarise.read(output_folder, 'transfers_and_no_bed').iloc[:, 0]
+        outputs = pd.Series()
+        for percentile in workload.index:
+            outputs['workload_%s' % percentile] = workload.loc[percentile, 'mean']
+        outputs['displaced'] = general.loc['displaced', 'mean']
+        outputs['episodes_no_bed'] = transfers['episodes_no_bed']
+        outputs['transfer_distance'] = transfers['transfer_distance']
+        return outputs
+
+    @classmethod
+    def load_scenario(cls, output_folder, hospital_info_df, allowed_overload_fraction):
+        """Row of features and outputs for a completed model run"""
+        return pd.concat([cls.scenario_features(hospital_info_df, allowed_overload_fraction),
+                          cls.scenario_outputs(output_folder)])
+
+    def fit(self, scenarios):
+        if self.features is None:
+            # Use all non-output columns that vary between scenarios
+            candidates = [column for column in scenarios.columns if column not in self.outputs]
+            self.features = [column for column in candidates
+                             if scenarios[column].nunique() > 1]
+        x = self.scaler.fit_transform(scenarios[self.features].values.astype(np.float64))
+
+        for output in self.outputs:
+            y = scenarios[output].values.astype(np.float64)
+            if self.method == 'gp':
+                kernel = (ConstantKernel() * RBF(length_scale=np.sqrt(len(self.features))) +
+                          WhiteKernel())
+                model = GaussianProcessRegressor(kernel=kernel, normalize_y=True,
+                                                 n_restarts_optimizer=2)
+                model.fit(x, y)
+                self.models[output] = model
+            elif self.method == 'gbt':
+                models = {}
+                for name, loss, alpha in [('mean', 'squared_error', 0.5),
+                                          ('low', 'quantile', 0.1),
+                                          ('high', 'quantile', 0.9)]:
+                    models[name] = GradientBoostingRegressor(loss=loss, alpha=alpha,
+                                                             n_estimators=200, max_depth=3)
+                    models[name].fit(x, y)
+                self.models[output] = models
+            else:
+                raise ValueError('Unknown surrogate method: %s' % self.method)
+
+    def predict(self, configurations):
+        """Returns (predicted mean, predicted std) DataFrames, one row per configuration"""
+        x = self.scaler.transform(configurations[self.features].values.astype(np.float64))
+        mean = pd.DataFrame(index=configurations.index)
+        std = pd.DataFrame(index=configurations.index)
+        for output in self.outputs:
+            if self.method == 'gp':
+                mean[output], std[output] = self.models[output].predict(x, return_std=True)
+            else:
+                models = self.models[output]
+                mean[output] = models['mean'].predict(x)
+                std[output] = (np.abs(models['high'].predict(x) - models['low'].predict(x)) /
+                               (2 * 1.28))
+        return mean, std
+
+    def select_for_simulation(self, configurations, n=5):
+        """Configurations (up to n) with highest predicted relative uncertainty in any output"""
+        mean, std = self.predict(configurations)
+        relative_std = (std / mean.abs().clip(lower=1e-9)).max(axis=1)
+        return configurations.loc[relative_std.sort_values(ascending=False).index[:n]]